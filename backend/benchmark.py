@@ -0,0 +1,369 @@
+"""
+Load and relevance benchmark for the search API.
+
+Replays a query corpus (titles, artists, English lyric lines, Thai) against
+the FastAPI app at a fixed concurrency and reports RPS and p50/p95/p99 latency
+per search mode, then scores a labelled query set (MRR@k, recall@k, top-1).
+
+Targets:
+    standin   (default) the real Elasticsearch code path (build_search_body, the
+              async client call, parse_hits) answered by a deterministic
+              in-process stand-in over bench/fixture.ndjson. Runs offline.
+    embedded  the embedded backend over the same fixture.
+    es        the live cluster configured in search_engine.py.
+    --url     a server that is already running (any backend).
+
+The app is driven in-process through httpx's ASGI transport, so the numbers
+cover routing, validation and serialization but not uvicorn or the network.
+The result cache is off unless --cache is given.
+
+Usage:
+    python benchmark.py [--target standin|embedded|es] [--concurrency 16] [--requests 2000]
+    python benchmark.py --url http://127.0.0.1:8000 --labels my_labels.jsonl
+    python benchmark.py --output after.json --baseline before.json --min-mrr 0.8
+
+The labels file has one JSON object per line:
+    {"q": "...", "is_artist_search": false, "relevant": [{"title": "...", "artist": "..."}]}
+The default labels only make sense for the fixture targets.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+# Nothing that imports search_engine at module level: its config is read from the env at import,
+# which configure() has to set first
+from utils import is_lyric_query
+
+# --- CONFIGURATION ---
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench")
+FIXTURE_PATH = os.path.join(BENCH_DIR, "fixture.ndjson")
+QUERIES_PATH = os.path.join(BENCH_DIR, "queries.txt")
+LABELS_PATH = os.path.join(BENCH_DIR, "labels.jsonl")
+
+TARGETS = ("standin", "embedded", "es")
+DEFAULT_CONCURRENCY = 16
+DEFAULT_REQUESTS = 2000
+RELEVANCE_K = 20
+PERCENTILES = (50, 95, 99)
+
+
+# -------------------------------
+# Elasticsearch stand-in
+# -------------------------------
+class FixtureES:
+    """
+    Deterministic stand-in for AsyncElasticsearch. Answers the bodies built by
+    build_search_body with the embedded engine (same scoring model as the ES
+    mapping), returned in the ES response shape so parse_hits runs unchanged.
+    latency_ms adds a fixed delay per call to model the network hop.
+    """
+
+    def __init__(self, engine, latency_ms: float = 0.0):
+        self.engine = engine
+        self.latency_ms = latency_ms
+        self.indices = self
+
+    async def get_field_mapping(self, index: str, fields: str, **kwargs) -> Dict[str, Any]:
+        # The fixture index always carries popularity (see search_engine.check_popularity_mapping)
+        return {index: {"mappings": {fields: {"full_name": fields}}}}
+
+    def _answer(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        match = body["query"]["function_score"]["query"]["multi_match"]
+        boosts = {}
+        for spec in match["fields"]:
+            name, _, boost = spec.partition("^")
+            if "." not in name:  # title.th etc. share the engine's field
+                boosts[name] = float(boost or 1)
+        source = body.get("_source", {})
+
+        hits = []
+        for hit in self.engine.search(
+            match["query"],
+            boosts,
+            match["minimum_should_match"],
+            body.get("min_score", 0.0),
+            size=body.get("size", 10),
+            search_after=body.get("search_after"),
+            includes=source.get("includes"),
+            excludes=source.get("excludes"),
+            highlight="highlight" in body,
+        ):
+            doc_id, score, fragment = hit.pop("id"), hit.pop("score"), hit.pop("highlight", None)
+            entry = {"_id": doc_id, "_score": score, "_source": hit, "sort": [score, doc_id]}
+            if fragment:
+                entry["highlight"] = {"lyrics": [fragment]}
+            hits.append(entry)
+
+        took = int((time.perf_counter() - start) * 1000)
+        return {"took": took, "timed_out": False, "hits": {"total": {"value": len(hits), "relation": "eq"}, "hits": hits}}
+
+    async def search(self, index: str, body: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        # Off the event loop, like a real cluster doing the work in another process
+        return await asyncio.to_thread(self._answer, body)
+
+    async def msearch(self, searches: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        bodies = searches[1::2]
+        return {"responses": [await asyncio.to_thread(self._answer, body) for body in bodies]}
+
+    async def close(self) -> None:
+        pass
+
+
+def configure(target: str, workdir: str, cache: bool) -> None:
+    """Point the app's env configuration at the benchmark target (before search_engine is imported)."""
+    os.environ["search_cache_enabled"] = "true" if cache else "false"
+    os.environ["search_cache_redis_url"] = ""
+    os.environ["index_generation_path"] = os.path.join(workdir, "index_generation")
+    if target == "es":
+        os.environ["search_backend"] = "elasticsearch"
+        return
+
+    from embedded_engine import build_index
+
+    index_path = os.path.join(workdir, "index")
+    build_index(FIXTURE_PATH, index_path)
+    os.environ["search_backend"] = "elasticsearch" if target == "standin" else "embedded"
+    os.environ["embedded_index_path"] = index_path
+    os.environ["suggest_dataset_path"] = FIXTURE_PATH
+
+
+def install_standin(workdir: str, latency_ms: float) -> None:
+    import search_engine
+    from embedded_engine import EmbeddedSearchEngine
+
+    # open_async_client() keeps an existing client, so the app picks this one up
+    search_engine.async_es = FixtureES(EmbeddedSearchEngine(os.path.join(workdir, "index")), latency_ms)
+
+
+# -------------------------------
+# Load
+# -------------------------------
+def mode_of(query: str, is_artist_search: bool) -> str:
+    # Same classification as search_engine.search_mode, without importing the app for --url runs
+    if is_artist_search:
+        return "artist"
+    return "lyric" if is_lyric_query(query) else "default"
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    corpus: List[Tuple[str, bool]],
+    concurrency: int,
+    total: int,
+    size: int,
+) -> Tuple[List[Tuple[str, float, int, int]], float]:
+    """Fire `total` searches round-robin over the corpus. Returns (mode, seconds, status, hits) per request and wall time."""
+    counter = itertools.count()
+    samples: List[Tuple[str, float, int, int]] = []
+
+    async def worker() -> None:
+        while True:
+            i = next(counter)
+            if i >= total:
+                return
+            query, is_artist_search = corpus[i % len(corpus)]
+            params = {"q": query, "is_artist_search": str(is_artist_search).lower(), "size": size}
+            start = time.perf_counter()
+            try:
+                response = await client.get("/search", params=params)
+                status = response.status_code
+                hits = len(response.json()["results"]) if status == 200 else 0
+            except httpx.HTTPError:
+                status, hits = 0, 0
+            samples.append((mode_of(query, is_artist_search), time.perf_counter() - start, status, hits))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, time.perf_counter() - started
+
+
+def summarize(samples: List[Tuple[str, float, int, int]], elapsed: float) -> Dict[str, Dict[str, float]]:
+    groups: Dict[str, List[Tuple[str, float, int, int]]] = {"all": samples}
+    for sample in samples:
+        groups.setdefault(sample[0], []).append(sample)
+
+    summary = {}
+    for mode, group in groups.items():
+        latencies = sorted(s[1] * 1000 for s in group)
+        stats = {
+            "requests": len(group),
+            "errors": sum(1 for s in group if s[2] != 200),
+            "empty": sum(1 for s in group if s[2] == 200 and s[3] == 0),
+            "rps": len(group) / elapsed if elapsed else 0.0,
+        }
+        for p in PERCENTILES:
+            stats[f"p{p}_ms"] = percentile(latencies, p)
+        summary[mode] = stats
+    return summary
+
+
+# -------------------------------
+# Relevance
+# -------------------------------
+def load_labels(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def key_of(doc: Dict[str, Any]) -> Tuple[str, str]:
+    return str(doc.get("title", "")).casefold(), str(doc.get("artist", "")).casefold()
+
+
+async def evaluate(client: httpx.AsyncClient, labels: List[Dict[str, Any]], k: int) -> Dict[str, Any]:
+    """MRR@k, mean recall@k and top-1 accuracy over the labelled queries."""
+    reciprocal_ranks, recalls, misses = [], [], []
+    for label in labels:
+        params = {
+            "q": label["q"],
+            "is_artist_search": str(label.get("is_artist_search", False)).lower(),
+            "size": k,
+            "fields": "title,artist",
+        }
+        response = await client.get("/search", params=params)
+        ranked = [key_of(hit) for hit in response.json()["results"]] if response.status_code == 200 else []
+        relevant = {key_of(doc) for doc in label["relevant"]}
+
+        rank = next((i for i, key in enumerate(ranked, 1) if key in relevant), None)
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+        recalls.append(len(relevant & set(ranked)) / len(relevant) if relevant else 1.0)
+        if rank != 1:
+            misses.append((label["q"], rank))
+
+    n = len(labels) or 1
+    return {
+        "queries": len(labels),
+        f"mrr@{k}": sum(reciprocal_ranks) / n,
+        f"recall@{k}": sum(recalls) / n,
+        "top1": sum(1 for rr in reciprocal_ranks if rr == 1.0) / n,
+        "misses": misses,
+    }
+
+
+# -------------------------------
+# Report
+# -------------------------------
+def print_report(results: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+    def delta(current: float, previous: Optional[float]) -> str:
+        if not previous:
+            return ""
+        return f" ({(current - previous) / previous:+.0%})"
+
+    print(f"\nTarget: {results['target']}   concurrency {results['concurrency']}   {results['requests']} requests")
+    print(f"{'mode':8} {'reqs':>6} {'err':>4} {'empty':>5} {'rps':>14} " + " ".join(f"{f'p{p} ms':>16}" for p in PERCENTILES))
+    for mode, stats in sorted(results["load"].items(), key=lambda item: item[0] != "all"):
+        before = (baseline or {}).get("load", {}).get(mode, {})
+        cells = [f"{stats['rps']:.0f}{delta(stats['rps'], before.get('rps'))}"]
+        cells += [f"{stats[f'p{p}_ms']:.1f}{delta(stats[f'p{p}_ms'], before.get(f'p{p}_ms'))}" for p in PERCENTILES]
+        print(f"{mode:8} {stats['requests']:>6} {stats['errors']:>4} {stats['empty']:>5} {cells[0]:>14} "
+              + " ".join(f"{cell:>16}" for cell in cells[1:]))
+
+    relevance = results.get("relevance")
+    if relevance:
+        k = results["k"]
+        before = (baseline or {}).get("relevance", {})
+        print(f"\nRelevance ({relevance['queries']} labelled queries)")
+        for metric in (f"mrr@{k}", f"recall@{k}", "top1"):
+            previous = before.get(metric)
+            change = f" (was {previous:.3f})" if previous is not None else ""
+            print(f"  {metric:10} {relevance[metric]:.3f}{change}")
+        for query, rank in relevance["misses"]:
+            print(f"  {'not found' if rank is None else f'rank {rank}':>9}: {query}")
+
+
+async def bench(args: argparse.Namespace, workdir: str) -> Dict[str, Any]:
+    if not args.url:
+        configure(args.target, workdir, args.cache)
+    from relevance_parity import load_queries
+
+    corpus = load_queries(args.queries)
+    labels = load_labels(args.labels) if args.labels else []
+
+    async def measure(client: httpx.AsyncClient) -> Dict[str, Any]:
+        # One untimed pass so lazy loading and first-call costs stay out of the numbers
+        await run_load(client, corpus, args.concurrency, len(corpus), args.size)
+        samples, elapsed = await run_load(client, corpus, args.concurrency, args.requests, args.size)
+        results = {
+            "target": args.url or args.target,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "k": args.k,
+            "load": summarize(samples, elapsed),
+        }
+        if labels:
+            results["relevance"] = await evaluate(client, labels, args.k)
+        return results
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=30) as client:
+            return await measure(client)
+
+    if args.target == "standin":
+        install_standin(workdir, args.es_latency_ms)
+    import main
+
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30) as client:
+            return await measure(client)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark /search throughput, latency and relevance.")
+    parser.add_argument("--target", choices=TARGETS, default="standin", help="Backend to run the app against")
+    parser.add_argument("--url", help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--queries", default=QUERIES_PATH, help="Query corpus (relevance_parity.py format)")
+    parser.add_argument("--labels", default=LABELS_PATH, help="Labelled queries for relevance ('' to skip)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Requests in flight")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help="Timed requests")
+    parser.add_argument("--size", type=int, default=20, help="Results per search")
+    parser.add_argument("--k", type=int, default=RELEVANCE_K, help="Cutoff for the relevance metrics")
+    parser.add_argument("--es-latency-ms", type=float, default=0.0, help="Simulated network delay for the stand-in")
+    parser.add_argument("--cache", action="store_true", help="Leave the result cache on")
+    parser.add_argument("--output", help="Write the results as JSON (use as --baseline for a later run)")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare against")
+    parser.add_argument("--min-mrr", type=float, default=None, help="Fail below this MRR@k")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        results = asyncio.run(bench(args, workdir))
+
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nResults written to '{args.output}'.")
+
+    relevance = results.get("relevance")
+    if args.min_mrr is not None and relevance and relevance[f"mrr@{args.k}"] < args.min_mrr:
+        print(f"FAIL: MRR@{args.k} below {args.min_mrr}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+# Optional shared backend: only needed when search_cache_redis_url is set
+try:
+    import redis
+    import redis.asyncio as redis_asyncio
+except ImportError:
+    redis = None
+    redis_asyncio = None
+
+load_dotenv()
+
+logger = logging.getLogger("search.cache")
+
+# --- CONFIGURATION ---
+CACHE_ENABLED = os.getenv("search_cache_enabled", "true").lower() == "true"
+CACHE_MAX_ENTRIES = int(os.getenv("search_cache_size", "10000"))
+CACHE_TTL = float(os.getenv("search_cache_ttl", "300"))  # seconds
+CACHE_REDIS_URL = os.getenv("search_cache_redis_url")  # e.g. redis://localhost:6379/0
+
+# Index generation: bumped by load_dataset.py after every upload.
+# Every cache key carries the generation, so a bump invalidates all entries at once.
+GENERATION_PATH = os.getenv(
+    "index_generation_path",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "index_generation"),
+)
+GENERATION_KEY = "songs:generation"
+GENERATION_CHECK_INTERVAL = 1.0  # seconds between generation re-reads
+REDIS_KEY_PREFIX = "songs:search:"
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase and collapse whitespace so trivially different inputs share an entry."""
+    return " ".join(query.lower().split())
+
+
+def make_key(query: str, is_artist_search: bool, mode: str, options: str = "") -> str:
+    """Cache key for one search: normalized query, artist flag, detected search mode and paging options."""
+    return f"{mode}|{int(is_artist_search)}|{options}|{normalize_query(query)}"
+
+
+def _redis_client(client=None):
+    if client is None and redis is not None and CACHE_REDIS_URL:
+        client = redis.Redis.from_url(CACHE_REDIS_URL, socket_timeout=0.05)
+    return client
+
+
+def _read_generation_file() -> int:
+    try:
+        with open(GENERATION_PATH, "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def read_generation(client=None) -> int:
+    """Current index generation (shared backend first, then the local generation file)."""
+    client = _redis_client(client)
+    if client is not None:
+        try:
+            value = client.get(GENERATION_KEY)
+            return int(value or 0)
+        except Exception as e:
+            logger.warning("Cache error: %s", e)
+    return _read_generation_file()
+
+
+async def aread_generation(client) -> int:
+    """read_generation() through an asyncio Redis client, for request handlers."""
+    if client is not None:
+        try:
+            value = await client.get(GENERATION_KEY)
+            return int(value or 0)
+        except Exception as e:
+            logger.warning("Cache error: %s", e)
+    return _read_generation_file()
+
+
+def bump_generation() -> int:
+    """Invalidate every cached result after new documents are written to the index."""
+    client = _redis_client()
+    generation = read_generation(client) + 1
+
+    if client is not None:
+        try:
+            generation = int(client.incr(GENERATION_KEY))
+        except Exception as e:
+            logger.warning("Cache error: %s", e)
+
+    # Write atomically so readers never see a half-written number
+    tmp_path = f"{GENERATION_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(str(generation))
+    os.replace(tmp_path, GENERATION_PATH)
+    return generation
+
+
+class SearchCache:
+    """
+    Bounded in-process LRU with TTL, optionally backed by a shared Redis store.
+
+    Lookups hit the local LRU first (no I/O), then the shared backend, whose hits
+    are copied into the local LRU. Cached hit lists are shared between callers
+    and must be treated as read-only.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        ttl: float = CACHE_TTL,
+        redis_url: Optional[str] = CACHE_REDIS_URL,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        self._redis = None
+        self._aredis = None
+        if redis_url:
+            if redis is None:
+                logger.warning("'redis' is not installed, using the in-process cache only.")
+            else:
+                self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.05)
+                self._aredis = redis_asyncio.Redis.from_url(redis_url, socket_timeout=0.05)
+
+        self.generation = read_generation(self._redis)
+        self._generation_checked = time.monotonic()
+
+    # -------------------------------
+    # Generation tracking
+    # -------------------------------
+    def _generation_due(self) -> bool:
+        now = time.monotonic()
+        if now - self._generation_checked < GENERATION_CHECK_INTERVAL:
+            return False
+        self._generation_checked = now
+        return True
+
+    def _check_generation(self) -> None:
+        if self._generation_due():
+            self._apply_generation(read_generation(self._redis))
+
+    async def _acheck_generation(self) -> None:
+        # Through the asyncio client, so the once-a-second read never blocks the event loop
+        if self._generation_due():
+            self._apply_generation(await aread_generation(self._aredis))
+
+    def _apply_generation(self, generation: int) -> None:
+        if generation != self.generation:
+            with self._lock:
+                self._entries.clear()
+            self.generation = generation
+
+    def _full_key(self, key: str) -> str:
+        return f"{REDIS_KEY_PREFIX}{self.generation}|{key}"
+
+    # -------------------------------
+    # Local LRU
+    # -------------------------------
+    def _get_local(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set_local(self, key: str, value: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # -------------------------------
+    # Public API
+    # -------------------------------
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        self._check_generation()
+        value = self._get_local(key)
+
+        if value is None and self._redis is not None:
+            try:
+                raw = self._redis.get(self._full_key(key))
+            except Exception as e:
+                logger.warning("Cache error: %s", e)
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self._set_local(key, value)
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: List[Dict[str, Any]]) -> None:
+        self._set_local(key, value)
+        if self._redis is not None:
+            try:
+                self._redis.set(self._full_key(key), json.dumps(value), ex=int(self.ttl))
+            except Exception as e:
+                logger.warning("Cache error: %s", e)
+
+    async def aget(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """Same as get(), but talks to the shared backend without blocking the event loop."""
+        await self._acheck_generation()
+        value = self._get_local(key)
+
+        if value is None and self._aredis is not None:
+            try:
+                raw = await self._aredis.get(self._full_key(key))
+            except Exception as e:
+                logger.warning("Cache error: %s", e)
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self._set_local(key, value)
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def aset(self, key: str, value: List[Dict[str, Any]]) -> None:
+        self._set_local(key, value)
+        if self._aredis is not None:
+            try:
+                await self._aredis.set(self._full_key(key), json.dumps(value), ex=int(self.ttl))
+            except Exception as e:
+                logger.warning("Cache error: %s", e)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+            "generation": self.generation,
+            "shared_backend": self._redis is not None,
+        }
+
+
+# Shared instance used by search_engine
+search_cache = SearchCache()
@@ -0,0 +1,550 @@
+"""
+Embedded, in-process search engine (no Elasticsearch required).
+
+Built once from songdb.ndjson into a directory of flat binary files that are
+memory-mapped at startup, so opening even a large index is close to instant:
+
+    <index>/meta.json               doc count, per-field stats, vocab length buckets
+    <index>/docs.ndjson             stored documents, one per line
+    <index>/docs.offsets            int64 byte offset of each stored document
+    <index>/popularity              float64 1 + log10(views + 1) per document
+    <index>/ids.terms               utf-8 blob of song ids, sorted
+    <index>/ids.term_offsets        int64 offsets into the id blob
+    <index>/ids.docs                int32 doc number of each sorted id
+    <index>/ids.rank                int32 position of each document's id in the sorted ids
+    <index>/{field}.terms           utf-8 vocabulary blob, sorted by (length, term)
+    <index>/{field}.term_offsets    int64 offsets into the vocabulary blob
+    <index>/{field}.term_sigs       uint64 character signature of each term
+    <index>/{field}.postings        int64 start of each term's postings
+    <index>/{field}.post_docs       int32 doc ids, grouped by term
+    <index>/{field}.post_tfs        int32 term frequencies, parallel to post_docs
+    <index>/{field}.lengths         int32 token count of the field per document
+
+Scoring mirrors search_engine.build_search_body: a most_fields multi_match
+(BM25 per field, per-field boosts, fuzziness AUTO, minimum_should_match per
+field) multiplied by 1 + log10(views + 1), then filtered by min_score.
+Results are ordered by (score desc, id asc), the same order as the ES sort, so
+search_after cursors work the same way on both backends.
+
+Usage:
+    python embedded_engine.py build [--dataset songdb.ndjson] [--out embedded_index]
+"""
+import argparse
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import sys
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils import clean_song_doc, popularity, song_id
+
+# Optional Thai word segmentation (same idea as the ES "thai" analyzer)
+try:
+    from pythainlp.tokenize import word_tokenize as thai_word_tokenize
+except ImportError:
+    thai_word_tokenize = None
+
+FIELDS = ("title", "artist", "lyrics")
+
+# Lucene BM25 defaults
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# ES queries every field twice (standard analyzer + ".th" sub-field) and sums both,
+# so each field counts twice here to keep scores on the same scale as min_score.
+ANALYZER_COPIES = 2
+
+# multi_match defaults for fuzzy queries
+MAX_EXPANSIONS = 50
+
+INDEX_FORMAT_VERSION = 2
+
+# Lyric fragment returned instead of full lyrics when highlighting
+HIGHLIGHT_FRAGMENT_SIZE = 150
+
+TOKEN_PATTERN = re.compile(r"[\u0E00-\u0E7F]+|\w+(?:['\u2019]\w+)*")
+
+
+# -------------------------------
+# Analysis
+# -------------------------------
+def _is_thai(token: str) -> bool:
+    return "\u0E00" <= token[0] <= "\u0E7F"
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """
+    Lowercased word tokens, roughly matching the ES standard analyzer.
+    Thai runs (no spaces between words) are segmented with pythainlp when it is
+    installed, and split into overlapping character bigrams otherwise.
+    """
+    if not text:
+        return []
+
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        if not _is_thai(token):
+            tokens.append(token)
+        elif thai_word_tokenize is not None:
+            tokens.extend(w for w in thai_word_tokenize(token, keep_whitespace=False) if w.strip())
+        elif len(token) <= 2:
+            tokens.append(token)
+        else:
+            tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+    return tokens
+
+
+def fuzziness_for(term: str) -> int:
+    """Edit distance allowed by fuzziness AUTO (0 for 1-2 chars, 1 for 3-5, 2 above)."""
+    if len(term) <= 2:
+        return 0
+    if len(term) <= 5:
+        return 1
+    return 2
+
+
+def char_signature(term: str) -> int:
+    """64-bit set of characters, used to reject fuzzy candidates before edit distance."""
+    sig = 0
+    for ch in term:
+        sig |= 1 << (ord(ch) & 63)
+    return sig
+
+
+def bounded_edit_distance(a: str, b: str, limit: int) -> int:
+    """Damerau-Levenshtein (adjacent transpositions) distance, or limit + 1 once it exceeds limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    prev_prev = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        row_min = i
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if prev_prev is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev_prev[j - 2] + 1)
+            row_min = min(row_min, cur[j])
+        if row_min > limit:
+            return limit + 1
+        prev_prev, prev = prev, cur
+    return prev[-1]
+
+
+def required_matches(min_match: str, clauses: int) -> int:
+    """Number of query terms a field must match for the minimum_should_match specs we use."""
+    if clauses == 0:
+        return 0
+
+    if "<" in min_match:
+        # "2<-1": up to 2 clauses all are required, above that all but one
+        threshold, rule = min_match.split("<", 1)
+        if clauses <= int(threshold):
+            return clauses
+        return required_matches(rule, clauses)
+
+    if min_match.endswith("%"):
+        pct = int(min_match[:-1])
+        required = int(clauses * pct / 100) if pct >= 0 else clauses - int(clauses * -pct / 100)
+    else:
+        value = int(min_match)
+        required = value if value >= 0 else clauses + value
+
+    return max(1, min(clauses, required))
+
+
+# -------------------------------
+# Building
+# -------------------------------
+def _write_array(path: str, typecode: str, values) -> None:
+    with open(path, "wb") as f:
+        array(typecode, values).tofile(f)
+
+
+def build_index(dataset_path: str, index_path: str) -> Dict[str, Any]:
+    """Build an embedded index directory from an NDJSON dataset."""
+    os.makedirs(index_path, exist_ok=True)
+
+    postings: Dict[str, Dict[str, List[Tuple[int, int]]]] = {field: defaultdict(list) for field in FIELDS}
+    lengths: Dict[str, array] = {field: array("i") for field in FIELDS}
+    multipliers = array("d")
+    doc_offsets = array("q")
+    ids: List[Tuple[str, int]] = []
+
+    num_docs = 0
+    with open(dataset_path, "r", encoding="utf-8") as src, \
+            open(os.path.join(index_path, "docs.ndjson"), "wb") as docs_out:
+        for line in src:
+            if not line.strip():
+                continue
+            doc = clean_song_doc(json.loads(line.strip()))
+            doc["song_id"] = song_id(doc)
+            ids.append((doc["song_id"], num_docs))
+
+            doc_offsets.append(docs_out.tell())
+            docs_out.write(json.dumps(doc, ensure_ascii=False).encode("utf-8") + b"\n")
+
+            for field in FIELDS:
+                tokens = tokenize(doc.get(field) if isinstance(doc.get(field), str) else None)
+                lengths[field].append(len(tokens))
+                counts: Dict[str, int] = defaultdict(int)
+                for token in tokens:
+                    counts[token] += 1
+                for token, tf in counts.items():
+                    postings[field][token].append((num_docs, tf))
+
+            multipliers.append(popularity(doc.get("views")))
+            num_docs += 1
+
+    doc_offsets.append(os.path.getsize(os.path.join(index_path, "docs.ndjson")))
+    _write_array(os.path.join(index_path, "docs.offsets"), "q", doc_offsets)
+    _write_array(os.path.join(index_path, "popularity"), "d", multipliers)
+
+    ids.sort()
+    id_blob = bytearray()
+    id_offsets = array("q")
+    for value, _ in ids:
+        id_offsets.append(len(id_blob))
+        id_blob += value.encode("utf-8")
+    id_offsets.append(len(id_blob))
+    with open(os.path.join(index_path, "ids.terms"), "wb") as f:
+        f.write(id_blob)
+    _write_array(os.path.join(index_path, "ids.term_offsets"), "q", id_offsets)
+    _write_array(os.path.join(index_path, "ids.docs"), "i", (doc_id for _, doc_id in ids))
+    rank = array("i", bytes(4 * num_docs))
+    for position, (_, doc_id) in enumerate(ids):
+        rank[doc_id] = position
+    _write_array(os.path.join(index_path, "ids.rank"), "i", rank)
+
+    meta: Dict[str, Any] = {"version": INDEX_FORMAT_VERSION, "num_docs": num_docs, "fields": {}}
+    for field in FIELDS:
+        terms = sorted(postings[field], key=lambda t: (len(t), t))
+
+        blob = bytearray()
+        term_offsets = array("q")
+        starts = array("q")
+        post_docs = array("i")
+        post_tfs = array("i")
+        buckets: Dict[int, List[int]] = {}
+        for term_id, term in enumerate(terms):
+            term_offsets.append(len(blob))
+            blob += term.encode("utf-8")
+            starts.append(len(post_docs))
+            for doc_id, tf in postings[field][term]:
+                post_docs.append(doc_id)
+                post_tfs.append(tf)
+            bucket = buckets.setdefault(len(term), [term_id, term_id])
+            bucket[1] = term_id + 1
+        term_offsets.append(len(blob))
+        starts.append(len(post_docs))
+
+        with open(os.path.join(index_path, f"{field}.terms"), "wb") as f:
+            f.write(blob)
+        _write_array(os.path.join(index_path, f"{field}.term_offsets"), "q", term_offsets)
+        _write_array(os.path.join(index_path, f"{field}.term_sigs"), "Q", (char_signature(t) for t in terms))
+        _write_array(os.path.join(index_path, f"{field}.postings"), "q", starts)
+        _write_array(os.path.join(index_path, f"{field}.post_docs"), "i", post_docs)
+        _write_array(os.path.join(index_path, f"{field}.post_tfs"), "i", post_tfs)
+        _write_array(os.path.join(index_path, f"{field}.lengths"), "i", lengths[field])
+
+        meta["fields"][field] = {
+            "vocab_size": len(terms),
+            "avg_length": (sum(lengths[field]) / num_docs) if num_docs else 0.0,
+            "length_buckets": {str(k): v for k, v in buckets.items()},
+        }
+        postings[field].clear()
+
+    with open(os.path.join(index_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    return meta
+
+
+# -------------------------------
+# Searching
+# -------------------------------
+class _MappedFile:
+    """Read-only memory map of a flat binary file, viewed as a typed array."""
+
+    def __init__(self, path: str, typecode: Optional[str] = None):
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        # mmap cannot map empty files
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        raw = memoryview(self._mmap) if self._mmap is not None else memoryview(b"")
+        self.view = raw.cast(typecode) if typecode else raw
+
+    def close(self) -> None:
+        self.view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+
+class _TermList:
+    """Sequence view over a sorted utf-8 string blob, so bisect can search it without decoding it all."""
+
+    def __init__(self, blob: memoryview, offsets: memoryview):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self._blob[self._offsets[i]:self._offsets[i + 1]]).decode("utf-8")
+
+
+class _FieldIndex:
+    def __init__(self, index_path: str, field: str, meta: Dict[str, Any]):
+        self.field = field
+        self.avg_length = meta["avg_length"] or 1.0
+        self.vocab_size = meta["vocab_size"]
+        self.buckets = {int(k): tuple(v) for k, v in meta["length_buckets"].items()}
+
+        def mapped(suffix: str, typecode: Optional[str] = None) -> _MappedFile:
+            return _MappedFile(os.path.join(index_path, f"{field}.{suffix}"), typecode)
+
+        self._files = [
+            mapped("terms"),
+            mapped("term_offsets", "q"),
+            mapped("term_sigs", "Q"),
+            mapped("postings", "q"),
+            mapped("post_docs", "i"),
+            mapped("post_tfs", "i"),
+            mapped("lengths", "i"),
+        ]
+        (self.terms, self.term_offsets, self.term_sigs, self.starts,
+         self.post_docs, self.post_tfs, self.lengths) = (f.view for f in self._files)
+
+        self._sorted_terms = _TermList(self.terms, self.term_offsets)
+        self.expand = lru_cache(maxsize=4096)(self._expand)
+
+    def close(self) -> None:
+        for f in self._files:
+            f.close()
+
+    def term(self, term_id: int) -> str:
+        return self._sorted_terms[term_id]
+
+    def doc_freq(self, term_id: int) -> int:
+        return self.starts[term_id + 1] - self.starts[term_id]
+
+    def lookup(self, term: str) -> Optional[int]:
+        """Exact term id (binary search inside the term's length bucket)."""
+        bucket = self.buckets.get(len(term))
+        if bucket is None:
+            return None
+        lo, hi = bucket
+        i = bisect_left(self._sorted_terms, term, lo, hi)
+        return i if i < hi and self.term(i) == term else None
+
+    def _expand(self, term: str) -> Tuple[Tuple[int, float], ...]:
+        """Vocabulary terms within fuzziness AUTO of term, as (term_id, similarity boost)."""
+        max_edits = fuzziness_for(term)
+        exact = self.lookup(term)
+        if max_edits == 0:
+            return ((exact, 1.0),) if exact is not None else ()
+
+        sig = char_signature(term)
+        candidates = []
+        for length in range(len(term) - max_edits, len(term) + max_edits + 1):
+            bucket = self.buckets.get(length)
+            if bucket is None:
+                continue
+            for term_id in range(*bucket):
+                other_sig = self.term_sigs[term_id]
+                # Every character missing on either side costs at least one edit
+                if bin(sig & ~other_sig).count("1") > max_edits or bin(other_sig & ~sig).count("1") > max_edits:
+                    continue
+                other = self.term(term_id)
+                edits = bounded_edit_distance(term, other, max_edits)
+                if edits <= max_edits:
+                    candidates.append((edits, -self.doc_freq(term_id), term_id, other))
+
+        # Like Lucene's FuzzyQuery: keep the closest terms, boost = 1 - edits / min length
+        candidates.sort()
+        return tuple(
+            (term_id, 1.0 - edits / min(len(term), len(other)))
+            for edits, _, term_id, other in candidates[:MAX_EXPANSIONS]
+        )
+
+
+class EmbeddedSearchEngine:
+    """Memory-mapped inverted index over title/artist/lyrics with BM25 scoring."""
+
+    def __init__(self, index_path: str):
+        with open(os.path.join(index_path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Embedded index at '{index_path}' has an unsupported format; rebuild it.")
+
+        self.num_docs = meta["num_docs"]
+        self.fields = {field: _FieldIndex(index_path, field, meta["fields"][field]) for field in FIELDS}
+
+        self._docs = _MappedFile(os.path.join(index_path, "docs.ndjson"))
+        self._doc_offsets = _MappedFile(os.path.join(index_path, "docs.offsets"), "q")
+        self._popularity = _MappedFile(os.path.join(index_path, "popularity"), "d")
+
+        self._id_blob = _MappedFile(os.path.join(index_path, "ids.terms"))
+        self._id_offsets = _MappedFile(os.path.join(index_path, "ids.term_offsets"), "q")
+        self._id_docs = _MappedFile(os.path.join(index_path, "ids.docs"), "i")
+        self._id_rank = _MappedFile(os.path.join(index_path, "ids.rank"), "i")
+        self._ids = _TermList(self._id_blob.view, self._id_offsets.view)
+
+    def close(self) -> None:
+        for field in self.fields.values():
+            field.close()
+        for f in (self._docs, self._doc_offsets, self._popularity, self._id_blob, self._id_offsets, self._id_docs, self._id_rank):
+            f.close()
+
+    def document(self, doc_id: int) -> Dict[str, Any]:
+        start, end = self._doc_offsets.view[doc_id], self._doc_offsets.view[doc_id + 1]
+        return json.loads(bytes(self._docs.view[start:end]))
+
+    def get(self, doc_key: str) -> Optional[Dict[str, Any]]:
+        """Full stored document for a song id, or None."""
+        i = bisect_left(self._ids, doc_key)
+        if i == len(self._ids) or self._ids[i] != doc_key:
+            return None
+        source = self.document(self._id_docs.view[i])
+        source["id"] = doc_key
+        return source
+
+    def _idf(self, doc_freq: int) -> float:
+        return math.log(1 + (self.num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    def _field_scores(self, field: _FieldIndex, tokens: List[str], boost: float, min_match: str) -> Dict[int, float]:
+        """Score of one field's match query (bool of fuzzy terms + minimum_should_match) per doc."""
+        scores: Dict[int, float] = defaultdict(float)
+        matched: Dict[int, int] = defaultdict(int)
+
+        for token in tokens:
+            # Best scoring expansion of this query term, per doc
+            best: Dict[int, float] = {}
+            for term_id, similarity in field.expand(token):
+                idf = self._idf(field.doc_freq(term_id))
+                for p in range(field.starts[term_id], field.starts[term_id + 1]):
+                    doc_id = field.post_docs[p]
+                    tf = field.post_tfs[p]
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * field.lengths[doc_id] / field.avg_length)
+                    score = similarity * idf * tf / (tf + norm)
+                    if score > best.get(doc_id, 0.0):
+                        best[doc_id] = score
+            for doc_id, score in best.items():
+                scores[doc_id] += score
+                matched[doc_id] += 1
+
+        required = required_matches(min_match, len(tokens))
+        return {
+            doc_id: score * boost * ANALYZER_COPIES
+            for doc_id, score in scores.items()
+            if matched[doc_id] >= required
+        }
+
+    def search(
+        self,
+        query: str,
+        boosts: Dict[str, float],
+        min_match: str,
+        score_cutoff: float,
+        size: int = 20,
+        search_after: Optional[List[Any]] = None,
+        includes: Optional[List[str]] = None,
+        excludes: Optional[List[str]] = None,
+        highlight: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """
+        Ranked hits for one page. search_after is the (score, id) of the previous
+        page's last hit; includes/excludes project the stored document like ES _source
+        filtering, and highlight adds a short lyric fragment around the first match.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        totals: Dict[int, float] = defaultdict(float)
+        for name, field in self.fields.items():
+            for doc_id, score in self._field_scores(field, tokens, boosts[name], min_match).items():
+                totals[doc_id] += score
+
+        # Order by (score desc, id asc); ids compare through their precomputed sort rank
+        popularity = self._popularity.view
+        id_rank = self._id_rank.view
+        ranked = []
+        for doc_id, text_score in totals.items():
+            score = text_score * popularity[doc_id]
+            if score >= score_cutoff:
+                ranked.append((-score, id_rank[doc_id], doc_id))
+
+        if search_after is not None:
+            after_id = str(search_after[1])
+            position = bisect_left(self._ids, after_id)
+            exact = position < len(self._ids) and self._ids[position] == after_id
+            after = (-float(search_after[0]), position if exact else position - 0.5)
+            ranked = [item for item in ranked if item[:2] > after]
+
+        hits = []
+        for neg_score, _, doc_id in heapq.nsmallest(size, ranked):
+            source = self.document(doc_id)
+            doc_key = source.get("song_id", "")
+            fragment = _highlight(source.get("lyrics"), tokens) if highlight else None
+            source = _project(source, includes, excludes)
+            source["id"] = doc_key
+            source["score"] = -neg_score
+            if fragment:
+                source["highlight"] = fragment
+            hits.append(source)
+        return hits
+
+
+def _project(source: Dict[str, Any], includes: Optional[List[str]], excludes: Optional[List[str]]) -> Dict[str, Any]:
+    if includes:
+        source = {k: v for k, v in source.items() if k in includes}
+    if excludes:
+        source = {k: v for k, v in source.items() if k not in excludes}
+    return source
+
+
+def _highlight(lyrics: Optional[str], tokens: List[str]) -> Optional[str]:
+    """Fragment of the lyrics around the first query term, with the term wrapped in <em> like ES."""
+    if not isinstance(lyrics, str):
+        return None
+
+    lower = lyrics.lower()
+    for token in tokens:
+        start = lower.find(token)
+        if start < 0:
+            continue
+        end = start + len(token)
+        left = max(0, start - (HIGHLIGHT_FRAGMENT_SIZE - len(token)) // 2)
+        right = min(len(lyrics), left + HIGHLIGHT_FRAGMENT_SIZE)
+        return f"{lyrics[left:start]}<em>{lyrics[start:end]}</em>{lyrics[end:right]}"
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the embedded song search index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Build an index directory from an NDJSON dataset")
+    build.add_argument("--dataset", default="songdb.ndjson")
+    build.add_argument("--out", default="embedded_index")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.dataset):
+        print(f"Dataset file '{args.dataset}' not found.")
+        sys.exit(1)
+
+    print(f"Building embedded index from {args.dataset}...")
+    meta = build_index(args.dataset, args.out)
+    print(f"Index built: {meta['num_docs']} documents in '{args.out}'.")
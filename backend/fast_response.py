@@ -0,0 +1,128 @@
+"""
+Opt-in fast serialization path for /search (fast_response=true).
+
+The default path validates every hit into a Song model and lets pydantic dump
+it. This path:
+
+- builds the response dict straight from the hits, keeping only Song fields
+  that are present (the same output as response_model_exclude_unset), with no
+  model validation;
+- encodes with orjson (in requirements.txt); without it, pydantic's own JSON
+  encoder on the plain dict, which is still much faster than stdlib json;
+- tags the body with a weak ETag and answers a matching If-None-Match with 304;
+- compresses bodies above compress_min_bytes with brotli (if installed) or gzip,
+  whichever the client prefers.
+
+See serialization_benchmark.py for the per-request cost of each step.
+"""
+import gzip
+import hashlib
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+import pydantic_core
+from dotenv import load_dotenv
+from fastapi import Request, Response
+
+from schemas import Song
+
+# Optional faster encoder / extra content coding
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+load_dotenv()
+
+logger = logging.getLogger("search")
+
+# --- CONFIGURATION ---
+FAST_RESPONSE = os.getenv("fast_response", "false").lower() == "true"
+COMPRESS_MIN_BYTES = int(os.getenv("compress_min_bytes", "1024"))  # smaller bodies aren't worth the CPU
+GZIP_LEVEL = 3  # ~3x cheaper than 5-6 on lyric pages for ~10% larger output
+BROTLI_QUALITY = 4  # brotli's default (11) is far too slow for per-request use
+
+SONG_FIELDS = tuple(Song.model_fields)
+MEDIA_TYPE = "application/json"
+
+if FAST_RESPONSE and orjson is None:
+    logger.warning("fast_response is on but orjson is not installed; encoding with pydantic_core instead.")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    # Not stdlib json: it is slower than the validated default path this one replaces
+    return pydantic_core.to_json(content)
+
+
+def search_payload(results: List[Dict[str, Any]], next_cursor: Optional[str]) -> bytes:
+    """JSON body of a SearchResponse, built without validating each hit."""
+    return dumps({
+        "results": [{name: hit[name] for name in SONG_FIELDS if name in hit} for hit in results],
+        "next_cursor": next_cursor,
+    })
+
+
+def etag_for(payload: bytes) -> str:
+    # Weak: the gzip/brotli/identity representations of one body share the tag.
+    # sha256 has hardware support on current CPUs and measures faster than blake2b/md5 here
+    return 'W/"' + hashlib.sha256(payload).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:]
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Best supported content coding from an Accept-Encoding header (br > gzip on ties)."""
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+
+    supported = ["br", "gzip"] if brotli is not None else ["gzip"]
+    candidates = [(weights.get(c, weights.get("*", 0.0)), -i, c) for i, c in enumerate(supported)]
+    weight, _, coding = max(candidates)
+    return coding if weight > 0 else None
+
+
+def compress(payload: bytes, coding: str) -> bytes:
+    if coding == "br":
+        return brotli.compress(payload, quality=BROTLI_QUALITY)
+    return gzip.compress(payload, compresslevel=GZIP_LEVEL)
+
+
+def json_response(request: Request, payload: bytes) -> Response:
+    """Conditional, compressed response for an encoded JSON body."""
+    etag = etag_for(payload)
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    if len(payload) >= COMPRESS_MIN_BYTES:
+        coding = choose_encoding(request.headers.get("accept-encoding"))
+        if coding is not None:
+            payload = compress(payload, coding)
+            headers["Content-Encoding"] = coding
+    return Response(content=payload, media_type=MEDIA_TYPE, headers=headers)
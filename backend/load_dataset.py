@@ -1,10 +1,39 @@
+"""
+Bulk loader for the songs index.
+
+    python load_dataset.py [songdb.ndjson ...] [--threads 4] [--chunk-mb 10] [--resume]
+
+- Documents are sent by parallel bulk workers in chunks cut by size in bytes
+  (not by document count), so requests stay evenly sized whether a chunk is
+  full of long lyrics or short ones. The size adapts to the cluster: it is
+  halved when a request comes back with 429 rejections and grows while full
+  chunks are indexed quickly, within BULK_MIN/MAX_CHUNK_BYTES.
+- While loading, refresh is disabled and replicas are set to 0; both are
+  restored (and the index refreshed) when the load ends, even on failure.
+- Documents the cluster rejects are written to a dead-letter NDJSON file with
+  the error; bulk-queue rejections (429) are retried with backoff first.
+- Progress is checkpointed as a byte offset per input file. --resume skips
+  everything already confirmed. Ids are deterministic, so re-sending the few
+  documents after the last checkpoint only overwrites them.
+- An existing index from before song_id/popularity is refused if it holds
+  documents (they would be duplicated); rebuild it with reindex.py.
+"""
 from elasticsearch import Elasticsearch, helpers, exceptions
 from dotenv import load_dotenv
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+import argparse
 import json
 import os
 import sys
+import threading
+import time
 import urllib3
 
+from cache import bump_generation
+from utils import clean_song_doc, popularity, song_id
+
 load_dotenv()
 # Suppress InsecureRequestWarning since we are using self-signed certs (verify_certs=False)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -18,25 +47,41 @@ ES_PASSWORD = os.getenv("es_password")
 DATASET_PATH = "songdb.ndjson"
 INDEX_NAME = "songs" 
 
+# Bulk tuning
+BULK_THREADS = 4
+BULK_CHUNK_BYTES = 10 * 1024 * 1024  # starting request size, adapted while loading
+BULK_MIN_CHUNK_BYTES = 1 * 1024 * 1024
+BULK_MAX_CHUNK_BYTES = 50 * 1024 * 1024  # well under ES's default http.max_content_length (100mb)
+BULK_FAST_SECONDS = 1.0              # full chunks answered faster than this grow the size by 25%
+BULK_SLOW_SECONDS = 10.0             # slower ones shrink it by 25%; any 429 halves it
+BULK_MAX_DOCS = 50000                # upper bound per chunk, bytes normally decide first
+BULK_QUEUE_SIZE = 8                  # chunks buffered ahead of the workers
+BULK_MAX_RETRIES = 5                 # retries for 429 (queue full) rejections
+
+CHECKPOINT_PATH = "load_checkpoint.json"
+DEAD_LETTER_PATH = "load_dead_letter.ndjson"
+CHECKPOINT_EVERY = 5.0  # seconds
+REPORT_EVERY = 2.0      # seconds
+
 # -------------------------------
 # 1. Connect to Elasticsearch
 # -------------------------------
-try:
+def connect() -> Elasticsearch:
     print(f" Connecting to {ES_HOST}...")
     es = Elasticsearch(
         ES_HOST,
         basic_auth=(ES_USER, ES_PASSWORD),
         verify_certs=False, 
-        ssl_show_warn=False
+        ssl_show_warn=False,
+        request_timeout=120,
+        retry_on_timeout=True,
     )
 
     if not es.ping():
         raise exceptions.ConnectionError(" Cannot connect to Elasticsearch!")
     print("Connected successfully!")
+    return es
 
-except Exception as e:
-    print(f"Connection failed: {e}")
-    sys.exit(1)
 
 # -------------------------------
 # 2. Define Index Mapping
@@ -76,7 +121,9 @@ mapping = {
                     "th": {"type": "text", "analyzer": "thai_analyzer"}
                 }
             },
+            "song_id": {"type": "keyword"}, # Stable id, also the pagination tiebreak
             "views": {"type": "integer"},
+            "popularity": {"type": "double"}, # 1 + log10(views + 1), used as the score multiplier
             "album": {"type": "text"},
             "duration": {"type": "keyword"},
             "year": {"type": "integer"}
@@ -84,57 +131,429 @@ mapping = {
     }
 }
 
+
+
 # -------------------------------
 # 3. Create Index
 # -------------------------------
-if es.indices.exists(index=INDEX_NAME):
-    print(f"Index '{INDEX_NAME}' already exists. Skipping creation.")
-else:
-    es.indices.create(index=INDEX_NAME, body=mapping)
-    print(f"Index '{INDEX_NAME}' created.")
+# Fields the loader and the search path depend on, added after the first release
+REQUIRED_FIELDS = {"song_id": "keyword", "popularity": "double"}
+
+
+def create_index(es: Elasticsearch, index: str = INDEX_NAME) -> None:
+    if not es.indices.exists(index=index):
+        es.indices.create(index=index, body=mapping)
+        print(f"Index '{index}' created.")
+        return
+
+    print(f"Index '{index}' already exists. Skipping creation.")
+    result = es.indices.get_field_mapping(index=index, fields=list(REQUIRED_FIELDS))
+    for name, field in getattr(result, "body", result).items():
+        mapped = {
+            key: next(iter(value["mapping"].values())).get("type")
+            for key, value in field.get("mappings", {}).items()
+        }
+        if mapped == REQUIRED_FIELDS:
+            continue
+        wrong = {key: kind for key, kind in mapped.items() if kind != REQUIRED_FIELDS[key]}
+        # Older documents have auto-generated ids and no popularity: loading next to them
+        # would duplicate every song and break popularity scoring
+        if wrong or es.count(index=name)["count"]:
+            raise ValueError(
+                f"Index '{name}' was created with an older mapping "
+                f"({', '.join(f'{k}: {v}' for k, v in wrong.items()) or 'no song_id/popularity'}). "
+                "Rebuild it with `python reindex.py` instead."
+            )
+        es.indices.put_mapping(
+            index=name, properties={key: {"type": kind} for key, kind in REQUIRED_FIELDS.items()}
+        )
+        print(f"Added song_id/popularity to the mapping of empty index '{name}'.")
+
+
+def prepare_for_bulk(es: Elasticsearch, index: str) -> Dict[str, Any]:
+    """Turn off refresh and replicas for the load; returns the settings to restore."""
+    current = es.indices.get_settings(index=index, flat_settings=True)
+    settings = next(iter(current.values()))["settings"]
+    saved = {
+        "index.refresh_interval": settings.get("index.refresh_interval", "1s"),
+        "index.number_of_replicas": settings.get("index.number_of_replicas", "1"),
+    }
+    es.indices.put_settings(
+        index=index,
+        settings={"index.refresh_interval": "-1", "index.number_of_replicas": 0},
+    )
+    return saved
+
+
+def restore_after_bulk(es: Elasticsearch, index: str, saved: Dict[str, Any]) -> None:
+    es.indices.put_settings(index=index, settings=saved)
+    es.indices.refresh(index=index)
+
 
 # -------------------------------
 # 4. Upload Data
 # -------------------------------
-if not os.path.exists(DATASET_PATH):
-    print(f"Dataset file '{DATASET_PATH}' not found. Skipping upload.")
-    sys.exit(0)
+def to_action(doc: Dict[str, Any], index: str) -> Dict[str, Any]:
+    doc = clean_song_doc(doc)
+    doc["song_id"] = song_id(doc)
+    # Precompute the ranking multiplier so queries need no script
+    doc["popularity"] = popularity(doc.get("views"))
+
+    return {
+        "_index": index,
+        "_id": doc["song_id"],
+        "_source": doc
+    }
 
-print("Uploading dataset...")
 
-def generate_actions():
-    with open(DATASET_PATH, "r", encoding="utf-8") as f:
+def generate_actions(path: str = DATASET_PATH, index: str = INDEX_NAME) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
         for line in f:
             if line.strip():
-                doc = json.loads(line.strip())
+                yield to_action(json.loads(line.strip()), index)
+
+
+def load_checkpoint(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_checkpoint(path: str, checkpoint: Dict[str, Any]) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+class BulkLoader:
+    """One load of NDJSON files into an index, with checkpoints, dead letters and progress."""
+
+    def __init__(
+        self,
+        es: Elasticsearch,
+        paths: List[str],
+        index: str = INDEX_NAME,
+        threads: int = BULK_THREADS,
+        chunk_bytes: int = BULK_CHUNK_BYTES,
+        checkpoint_path: str = CHECKPOINT_PATH,
+        dead_letter_path: str = DEAD_LETTER_PATH,
+        resume: bool = False,
+    ):
+        self.es = es
+        self.paths = paths
+        self.index = index
+        self.threads = threads
+        self.chunk_bytes = chunk_bytes
+        self.checkpoint_path = checkpoint_path
+        self.dead_letter_path = dead_letter_path
+
+        self.checkpoint: Dict[str, Any] = {"index": index, "offsets": {}}
+        if resume:
+            saved = load_checkpoint(checkpoint_path)
+            if saved.get("index") == index:
+                self.checkpoint = saved
+            elif saved:
+                print(f"Checkpoint is for index '{saved.get('index')}', not '{index}'. Starting over.")
+
+        # (path, end offset, raw line) for every action handed to the workers, in order
+        self._in_flight: Deque[Tuple[str, int, bytes]] = deque()
+        self._retry: List[Tuple[bytes, Dict[str, Any]]] = []
+        self._dead_letter = None
+        # Invalid lines are dead-lettered by the bulk producer thread, the rest by the main thread
+        self._dead_letter_lock = threading.Lock()
+        # Bulk workers adapt chunk_bytes from their responses; the chunker reads it per chunk
+        self._chunk_lock = threading.Lock()
+        self._dumps = es.transport.serializers.get_serializer("application/json").dumps
+
+        self.submitted = 0  # handed to the bulk workers, so possibly in the index even if the load fails
+        self.indexed = 0
+        self.failed = 0
+        self.bytes_done = 0
+        self._started = 0.0
+        self._last_report = 0.0
+        self._last_checkpoint = 0.0
 
-                # Data Cleaning: Convert year safely
-                if "year" in doc and doc["year"]:
+    # -------------------------------
+    # Input
+    # -------------------------------
+    def _actions(self) -> Iterator[Dict[str, Any]]:
+        for path in self.paths:
+            offset = self.checkpoint["offsets"].get(path, 0)
+            if offset:
+                print(f"Resuming '{path}' at byte {offset}.")
+            with open(path, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    offset += len(line)
+                    if not line.strip():
+                        continue
                     try:
-                        # Handle cases where year might be ["2020"] or "2020"
-                        val = doc["year"][0] if isinstance(doc["year"], list) else doc["year"]
-                        doc["year"] = int(val)
-                    except (ValueError, IndexError, TypeError):
-                        doc["year"] = None
-                
-                # Remove junk fields
-                for redundant in ["lyrics_clean", "lyrics_clean.keyword", "features.keyword", "year.keyword"]:
-                    doc.pop(redundant, None)
-
-                yield {
-                    "_index": INDEX_NAME,
-                    "_source": doc
-                }
+                        doc = json.loads(line)
+                    except ValueError as e:
+                        self._write_dead_letter(line, {"error": f"Invalid JSON: {e}"})
+                        continue
+                    if not isinstance(doc, dict):
+                        self._write_dead_letter(line, {"error": f"Expected a JSON object, got {type(doc).__name__}"})
+                        continue
+                    try:
+                        action = to_action(doc, self.index)
+                    except (TypeError, ValueError, AttributeError) as e:
+                        # One malformed document must not stop the producer thread (and the load)
+                        self._write_dead_letter(line, {"error": f"Invalid document: {e}"})
+                        continue
+                    self._in_flight.append((path, offset, line))
+                    self.submitted += 1
+                    yield action
+            # Empty files and trailing blank lines still count as done
+            self._in_flight.append((path, offset, b""))
+
+    # -------------------------------
+    # Sending
+    # -------------------------------
+    def _chunks(self, actions: Iterator[Dict[str, Any]]) -> Iterator[Tuple[List[bytes], int]]:
+        """Bulk bodies of up to chunk_bytes (its value when each chunk starts), with their size."""
+        lines: List[bytes] = []
+        size = 0
+        limit = self.chunk_bytes
+        for action in actions:
+            header = self._dumps({"index": {"_index": action["_index"], "_id": action["_id"]}})
+            source = self._dumps(action["_source"])
+            doc_size = len(header) + len(source) + 2
+            if lines and (size + doc_size > limit or len(lines) // 2 == BULK_MAX_DOCS):
+                yield lines, size
+                lines, size, limit = [], 0, self.chunk_bytes
+            lines += [header, source]
+            size += doc_size
+        if lines:
+            yield lines, size
+
+    def _send(self, lines: List[bytes], size: int) -> List[Tuple[bool, Dict[str, Any]]]:
+        """One bulk request, as (ok, item) per document like the bulk helpers report them."""
+        started = time.monotonic()
+        try:
+            items = self.es.bulk(operations=lines)["items"]
+        except exceptions.ApiError as e:
+            # The whole request was rejected; a 429 here is retried like per-document ones
+            items = [{"index": {"status": e.status_code, "error": str(e)}}] * (len(lines) // 2)
+        results = [(200 <= item["index"].get("status", 500) < 300, item) for item in items]
+        throttled = any(item["index"].get("status") == 429 for item in items)
+        self._adapt(size, time.monotonic() - started, throttled)
+        return results
+
+    def _adapt(self, size: int, seconds: float, throttled: bool) -> None:
+        with self._chunk_lock:
+            if throttled:
+                self.chunk_bytes = max(BULK_MIN_CHUNK_BYTES, self.chunk_bytes // 2)
+            elif seconds > BULK_SLOW_SECONDS:
+                self.chunk_bytes = max(BULK_MIN_CHUNK_BYTES, int(self.chunk_bytes * 0.75))
+            elif seconds < BULK_FAST_SECONDS and size >= self.chunk_bytes * 0.9:
+                # Only full chunks say anything about a bigger size (not the last one of a file)
+                self.chunk_bytes = min(BULK_MAX_CHUNK_BYTES, int(self.chunk_bytes * 1.25))
+
+    def _bulk(self, actions: Iterator[Dict[str, Any]]) -> Iterator[Tuple[bool, Dict[str, Any]]]:
+        """Send chunks on `threads` workers; results come back in input order."""
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            pending: Deque[Future] = deque()
+            for lines, size in self._chunks(actions):
+                pending.append(pool.submit(self._send, lines, size))
+                if len(pending) > self.threads + BULK_QUEUE_SIZE:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    # -------------------------------
+    # Results
+    # -------------------------------
+    def _write_dead_letter(self, line: bytes, info: Dict[str, Any]) -> None:
+        record = {"error": info, "doc": line.decode("utf-8", errors="replace").strip()}
+        with self._dead_letter_lock:
+            if self._dead_letter is None:
+                self._dead_letter = open(self.dead_letter_path, "ab")
+            self._dead_letter.write(json.dumps(record, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+            self.failed += 1
+
+    def _handle(self, ok: bool, info: Dict[str, Any]) -> None:
+        path, offset, line = self._in_flight.popleft()
+        # Skip end-of-file markers
+        while not line:
+            self.checkpoint["offsets"][path] = offset
+            path, offset, line = self._in_flight.popleft()
+
+        self.bytes_done += len(line)
+        if ok:
+            self.indexed += 1
+        else:
+            item = next(iter(info.values()), {})
+            if item.get("status") == 429:
+                self._retry.append((line, item))
+            else:
+                self._write_dead_letter(line, item)
+        self.checkpoint["offsets"][path] = offset
+
+    def _flush_retries(self) -> None:
+        """Re-send 429-rejected documents, with exponential backoff, before checkpointing past them."""
+        if not self._retry:
+            return
+        retry, self._retry = self._retry, []
+        actions = [to_action(json.loads(line), self.index) for line, _ in retry]
+        # streaming_bulk reports retried documents out of order, so match results by id
+        lines = {action["_id"]: line for action, (line, _) in zip(actions, retry)}
+        results = helpers.streaming_bulk(
+            self.es,
+            actions,
+            chunk_size=BULK_MAX_DOCS,
+            max_chunk_bytes=self.chunk_bytes,
+            max_retries=BULK_MAX_RETRIES,
+            initial_backoff=2,
+            raise_on_error=False,
+            raise_on_exception=False,
+        )
+        for ok, info in results:
+            item = next(iter(info.values()), {})
+            line = lines.pop(item.get("_id"), b"")
+            if ok:
+                self.indexed += 1
+            else:
+                self._write_dead_letter(line, item)
+
+    def _save(self) -> None:
+        self._flush_retries()
+        if self._dead_letter is not None:
+            self._dead_letter.flush()
+        save_checkpoint(self.checkpoint_path, self.checkpoint)
+
+    def _report(self, final: bool = False) -> None:
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        print(
+            f"{'Done' if final else 'Progress'}: {self.indexed} indexed, {self.failed} failed "
+            f"| {self.indexed / elapsed:,.0f} docs/s, {self.bytes_done / elapsed / 1e6:.1f} MB/s "
+            f"| chunk {self.chunk_bytes / 1024 / 1024:.1f} MB"
+        )
+
+    # -------------------------------
+    # Run
+    # -------------------------------
+    def run(self) -> Tuple[int, int]:
+        self._started = self._last_report = self._last_checkpoint = time.monotonic()
+
+        results = self._bulk(self._actions())
+        try:
+            # Results come back in input order, so each one settles the oldest in-flight line
+            for ok, info in results:
+                self._handle(ok, info)
+
+                now = time.monotonic()
+                if now - self._last_report >= REPORT_EVERY:
+                    self._report()
+                    self._last_report = now
+                if now - self._last_checkpoint >= CHECKPOINT_EVERY:
+                    self._save()
+                    self._last_checkpoint = now
+
+            self._flush_retries()
+            # The whole input is in: the next run starts from scratch
+            if os.path.exists(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
+        finally:
+            if self._dead_letter is not None:
+                self._dead_letter.close()
+
+        self._report(final=True)
+        return self.indexed, self.failed
+
+
+def load(
+    es: Elasticsearch,
+    paths: List[str],
+    index: str = INDEX_NAME,
+    threads: int = BULK_THREADS,
+    chunk_bytes: int = BULK_CHUNK_BYTES,
+    resume: bool = False,
+    checkpoint_path: str = CHECKPOINT_PATH,
+    dead_letter_path: str = DEAD_LETTER_PATH,
+    invalidate_cache: bool = True,
+) -> Tuple[int, int]:
+    """Bulk load NDJSON files into an existing index with ingest-friendly settings.
+
+    The search cache generation is bumped whenever documents were sent, even
+    if the load then fails: they are refreshed into view all the same. Pass
+    invalidate_cache=False for an index that is not serving yet.
+    """
+    saved = prepare_for_bulk(es, index)
+    loader = None
+    try:
+        loader = BulkLoader(
+            es,
+            paths,
+            index=index,
+            threads=threads,
+            chunk_bytes=chunk_bytes,
+            checkpoint_path=checkpoint_path,
+            dead_letter_path=dead_letter_path,
+            resume=resume,
+        )
+        return loader.run()
+    finally:
+        restore_after_bulk(es, index, saved)
+        # Cached search results are stale now that the index changed
+        if invalidate_cache and loader is not None and loader.submitted:
+            generation = bump_generation()
+            print(f"Search cache invalidated (index generation {generation}).")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Bulk load songs into Elasticsearch.")
+    parser.add_argument("paths", nargs="*", default=[DATASET_PATH], help="NDJSON files to load")
+    parser.add_argument("--index", default=INDEX_NAME)
+    parser.add_argument("--threads", type=int, default=BULK_THREADS, help="Parallel bulk workers")
+    parser.add_argument("--chunk-mb", type=float, default=BULK_CHUNK_BYTES / 1024 / 1024, help="Starting bulk request size")
+    parser.add_argument("--resume", action="store_true", help="Continue from the last checkpoint")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--dead-letter", default=DEAD_LETTER_PATH)
+    args = parser.parse_args(argv)
+
+    missing = [p for p in args.paths if not os.path.exists(p)]
+    if missing:
+        print(f"Dataset file(s) not found: {', '.join(missing)}. Skipping upload.")
+        return 0
+
+    try:
+        es = connect()
+    except Exception as e:
+        print(f"Connection failed: {e}")
+        return 1
+
+    try:
+        create_index(es, args.index)
+    except ValueError as e:
+        print(e)
+        return 1
+
+    print("Uploading dataset...")
+    try:
+        success, failed = load(
+            es,
+            args.paths,
+            index=args.index,
+            threads=args.threads,
+            chunk_bytes=int(args.chunk_mb * 1024 * 1024),
+            resume=args.resume,
+            checkpoint_path=args.checkpoint,
+            dead_letter_path=args.dead_letter,
+        )
+    except Exception as e:
+        print(f"Bulk upload error: {e}")
+        print("Re-run with --resume to continue from the last checkpoint.")
+        return 1
 
-try:
-    success, failed = helpers.bulk(
-        es,
-        generate_actions(),
-        chunk_size=2000,
-        max_retries=5,
-        request_timeout=60,
-        stats_only=True
-    )
     print(f"Upload complete {success} documents indexed.")
-except Exception as e:
-    print(f"Bulk upload error: {e}")
\ No newline at end of file
+    if failed:
+        print(f"{failed} documents failed, see '{args.dead_letter}'.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
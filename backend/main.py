@@ -1,12 +1,51 @@
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from contextlib import asynccontextmanager
+import asyncio
+import secrets
+from typing import List, Optional
 import uvicorn
 
-from search_engine import search_songs
-from schemas import SearchResponse
+from search_engine import (
+    ADMIN_TOKEN,
+    DEFAULT_PAGE_SIZE,
+    MAX_BATCH_SIZE,
+    MAX_PAGE_SIZE,
+    async_get_song,
+    async_search_songs,
+    async_search_songs_batch,
+    close_backend,
+    encode_cursor,
+    make_search_options,
+    open_backend,
+    recent_queries,
+)
+from cache import search_cache
+import fast_response
+import metrics
+from schemas import (
+    BatchSearchRequest,
+    BatchSearchResponse,
+    BatchSearchResult,
+    SearchResponse,
+    Song,
+    SuggestResponse,
+)
+import suggest
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One shared backend for every request
+    # (a pooled AsyncElasticsearch client, or the memory-mapped embedded index)
+    await open_backend()
+    # Typeahead index is built in-process from the dataset
+    await asyncio.to_thread(suggest.load_suggest_index)
+    yield
+    await close_backend()
 
-app = FastAPI(title="Song Search API")
+
+app = FastAPI(title="Song Search API", lifespan=lifespan)
 
 # Allow Flutter front-end
 app.add_middleware(
@@ -21,14 +60,88 @@ app.add_middleware(
 def root():
     return {"message": "Song Search API with Elasticsearch is running!"}
 
-@app.get("/search", response_model=SearchResponse)
-def search_endpoint(
+# Unset fields are left out so projected results don't carry placeholder defaults
+@app.get("/search", response_model=SearchResponse, response_model_exclude_unset=True)
+async def search_endpoint(
+    request: Request,
     q: str = Query(..., min_length=1, description="Search for songs by title, artist, or lyrics"),
-    is_artist_search: bool = Query(False, description="Boost artist field if true")
+    is_artist_search: bool = Query(False, description="Boost artist field if true"),
+    size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Results per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. title,artist,views"),
+    exclude: Optional[str] = Query(None, description="Comma-separated fields to leave out, e.g. lyrics"),
+    highlight: bool = Query(False, description="Add a short highlighted lyric fragment to each result"),
 ):
+    try:
+        options = make_search_options(size, cursor, fields, exclude, highlight)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    trace = metrics.start_trace(q, is_artist_search)
     # results = search_songs(q)
-    results = search_songs(q, is_artist_search)
-    return SearchResponse(results=results)
+    results = await async_search_songs(q, is_artist_search, options)
+    next_cursor = encode_cursor(results[-1]) if len(results) == options.size else None
+
+    # Serialized here rather than by FastAPI so the cost shows up as its own stage
+    with trace.stage("serialize"):
+        if fast_response.FAST_RESPONSE:
+            # No per-hit validation, orjson, ETag/304 and gzip/brotli (see fast_response.py)
+            response = fast_response.json_response(request, fast_response.search_payload(results, next_cursor))
+        else:
+            payload = SearchResponse(results=results, next_cursor=next_cursor).model_dump_json(exclude_unset=True)
+            response = Response(content=payload, media_type="application/json")
+    metrics.finish_trace(trace)
+    return response
+
+# Many queries in one call (playlist imports, "did you mean" fan-out), sent as one _msearch
+@app.post("/search/batch", response_model=BatchSearchResponse, response_model_exclude_unset=True)
+async def batch_search_endpoint(request: BatchSearchRequest):
+    if len(request.queries) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} queries per batch")
+
+    options = make_search_options(request.size, fields=request.fields, exclude=request.exclude)
+    outcomes = await async_search_songs_batch(
+        [(item.q, item.is_artist_search) for item in request.queries], options
+    )
+    return BatchSearchResponse(responses=[
+        BatchSearchResult(results=hits, error=error) if error else BatchSearchResult(results=hits)
+        for hits, error in outcomes
+    ])
+
+@app.get("/songs/{song_id}", response_model=Song)
+async def song_detail_endpoint(song_id: str):
+    song = await async_get_song(song_id)
+    if song is None:
+        raise HTTPException(status_code=404, detail="Song not found")
+    return song
+
+# Prefix completion for search-as-you-type; answered from memory, no ES round trip
+@app.get("/suggest", response_model=SuggestResponse)
+async def suggest_endpoint(
+    q: str = Query(..., min_length=1, description="What the user has typed so far"),
+    limit: int = Query(10, ge=1, le=suggest.MAX_SUGGESTIONS),
+    is_artist_search: bool = Query(False, description="Only suggest artists if true"),
+):
+    if suggest.suggest_index is None:
+        return SuggestResponse(suggestions=[])
+    return SuggestResponse(suggestions=suggest.suggest_index.suggest(q, limit, artists_only=is_artist_search))
+
+# Replayed by reindex.py to warm a freshly built index before it goes live.
+# Admin only (X-Admin-Token: admin_token); without a configured token the route doesn't exist
+@app.get("/queries/recent", include_in_schema=False)
+def recent_queries_endpoint(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return {"queries": [{"q": q, "is_artist_search": a} for q, a in recent_queries]}
+
+@app.get("/cache/stats")
+def cache_stats():
+    return search_cache.stats()
+
+# Prometheus scrape target: per-stage latency histograms by mode, error/empty/slow counters
+@app.get("/metrics")
+def metrics_endpoint():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
@@ -0,0 +1,208 @@
+"""
+Latency instrumentation for the search path, exported in Prometheus text format.
+
+Every /search request carries a SearchTrace (through a context variable, so it
+reaches the backend and worker threads without changing signatures). Stages
+record their duration into it:
+
+    classify        search_mode / is_lyric_query
+    build_body      build_search_body
+    es_round_trip   client-side time of the ES call
+    es_took         time ES reports in `took`
+    postprocess     parse_hits
+    engine          whole search on the embedded backend
+    serialize       pydantic model + JSON encoding
+    total           whole request
+
+Each stage feeds the search_stage_seconds histogram, labelled by stage and
+mode (artist/lyric/default). Searches outside a /search request (batch
+items, scripts) get a detached trace that records nothing. Requests slower than slow_query_ms are written to
+the "search.slow" logger with the full query body.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from cache import search_cache
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+SLOW_QUERY_MS = float(os.getenv("slow_query_ms", "500"))
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+slow_log = logging.getLogger("search.slow")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        # labels -> (per-bucket counts, sum, count)
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            series = self._series.setdefault(labels, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    bucket_labels = _labels(self.label_names + ("le",), labels + (str(bound),))
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                inf_labels = _labels(self.label_names + ("le",), labels + ("+Inf",))
+                lines.append(f"{self.name}_bucket{inf_labels} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("search_stage_seconds", "Time spent per search stage.", ("stage", "mode"))
+REQUESTS = Counter("search_requests_total", "Search requests.", ("mode",))
+ERRORS = Counter("search_errors_total", "Searches that failed (returned as empty results).", ("mode",))
+EMPTY_RESULTS = Counter("search_empty_results_total", "Successful searches with no hits.", ("mode",))
+CACHE_HITS = Counter("search_cache_served_total", "Search requests answered from the result cache.", ("mode",))
+SLOW_QUERIES = Counter("search_slow_queries_total", "Searches slower than slow_query_ms.", ("mode",))
+
+
+class SearchTrace:
+    """Stage timings and outcome of one search request."""
+
+    def __init__(self, query: str = "", is_artist_search: bool = False, observe: bool = True):
+        self.query = query
+        self.is_artist_search = is_artist_search
+        self.mode = "unknown"
+        self.stages: Dict[str, float] = {}
+        self.body: Optional[Dict[str, Any]] = None
+        self.hits = 0
+        self.cache_hit = False
+        self.error: Optional[str] = None
+        self.started = time.perf_counter()
+        self.observe = observe
+
+    def record(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        if self.observe:
+            STAGE_SECONDS.observe(seconds, stage, self.mode)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+
+_current_trace: ContextVar[Optional[SearchTrace]] = ContextVar("search_trace", default=None)
+
+
+def start_trace(query: str = "", is_artist_search: bool = False) -> SearchTrace:
+    """Begin tracing the current request; stages recorded below this call land in the returned trace."""
+    trace = SearchTrace(query, is_artist_search)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> SearchTrace:
+    """The current request's trace, or a detached one that observes nothing (batch, scripts, sync callers)."""
+    trace = _current_trace.get()
+    # Detached timings would land under mode="unknown" in a histogram meant for artist/lyric/default
+    return trace if trace is not None else SearchTrace(observe=False)
+
+
+def finish_trace(trace: SearchTrace) -> None:
+    """Count the request by outcome and write it to the slow-query log if needed."""
+    total = time.perf_counter() - trace.started
+    trace.record("total", total)
+
+    REQUESTS.inc(trace.mode)
+    # Errors are counted where they are caught (search_engine), so batch and script calls count too
+    if trace.error is None and trace.hits == 0:
+        EMPTY_RESULTS.inc(trace.mode)
+    if trace.cache_hit:
+        CACHE_HITS.inc(trace.mode)
+
+    total_ms = total * 1000
+    if total_ms >= SLOW_QUERY_MS:
+        SLOW_QUERIES.inc(trace.mode)
+        slow_log.warning(json.dumps({
+            "query": trace.query,
+            "is_artist_search": trace.is_artist_search,
+            "mode": trace.mode,
+            "total_ms": round(total_ms, 2),
+            "stages_ms": {k: round(v * 1000, 2) for k, v in trace.stages.items()},
+            "hits": trace.hits,
+            "cache_hit": trace.cache_hit,
+            "error": trace.error,
+            "body": trace.body,
+        }, ensure_ascii=False, default=str))
+    _current_trace.set(None)
+
+
+def render() -> str:
+    """All metrics in Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in (STAGE_SECONDS, REQUESTS, ERRORS, EMPTY_RESULTS, CACHE_HITS, SLOW_QUERIES):
+        lines.extend(metric.render())
+
+    stats = search_cache.stats()
+    lines += [
+        "# HELP search_cache_hits_total Result cache lookups that hit.",
+        "# TYPE search_cache_hits_total counter",
+        f"search_cache_hits_total {stats['hits']}",
+        "# HELP search_cache_misses_total Result cache lookups that missed.",
+        "# TYPE search_cache_misses_total counter",
+        f"search_cache_misses_total {stats['misses']}",
+        "# HELP search_cache_entries Entries in the in-process result cache.",
+        "# TYPE search_cache_entries gauge",
+        f"search_cache_entries {stats['entries']}",
+    ]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,219 @@
+"""
+Streaming preprocessing of the Genius lyrics CSV into loader-ready NDJSON.
+
+Replaces the concat-everything flow of `dataset preprocessing/data_prep.ipynb`
+with the same filters applied chunk by chunk:
+
+- only the needed columns are parsed, all as strings (numbers are coerced per chunk);
+- rows are kept if language is en/th, year is within 1990-2022 and the title
+  does not look like a translation;
+- documents are cleaned with utils.clean_song_doc, exactly like the loader does,
+  and keep the Genius `id`, which becomes their song_id (a content hash would
+  change with every dump, since it includes views);
+- chunks are filtered and serialized in a process pool, with a bounded number
+  of chunks in flight, and written to NDJSON shards as they complete.
+
+Peak memory is a few chunks regardless of the dump size. Shards are written
+under a temporary name and renamed when complete, so they can be bulk loaded
+as soon as they appear; a failed run leaves no partial shard behind. Shards
+from an earlier run in the output directory are removed first:
+
+    python prepare_dataset.py song_lyrics.csv --out dataset
+    python load_dataset.py dataset/songdb-*.ndjson
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, Iterator, Optional, Tuple
+
+import pandas as pd
+
+from utils import clean_song_doc
+
+# --- CONFIGURATION ---
+KEEP_COLUMNS = ["id", "title", "artist", "year", "views", "lyrics"]
+READ_COLUMNS = KEEP_COLUMNS + ["language"]
+LANGUAGES = {"en", "th"}
+YEAR_MIN, YEAR_MAX = 1990, 2022
+
+CHUNK_SIZE = 50000
+SHARD_SIZE = 500000  # documents per output shard (0 = one file)
+SHARD_NAME = "songdb-{:05d}.ndjson"
+SHARD_GLOB = "songdb-*.ndjson"
+
+# pattern to detect translations (in both EN + TH)
+BAD_TITLE_PATTERN = re.compile(
+    r'(?:แปลไทย|แปลภาษาไทย|translation|translated|เวอร์ชันไทย|thai version|english translation)',
+    re.IGNORECASE
+)
+
+
+def _none_if_nan(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value
+
+
+def process_chunk(chunk: pd.DataFrame) -> Tuple[bytes, int, int]:
+    """Filter and clean one chunk. Returns (NDJSON bytes, rows read, rows kept)."""
+    rows_in = len(chunk)
+
+    chunk = chunk[chunk["language"].isin(LANGUAGES)]
+    year = pd.to_numeric(chunk["year"], errors="coerce")
+    chunk = chunk[(year >= YEAR_MIN) & (year <= YEAR_MAX)]
+    # keep only rows that DO NOT match
+    chunk = chunk[~chunk["title"].str.contains(BAD_TITLE_PATTERN, na=False)]
+
+    views = pd.to_numeric(chunk["views"], errors="coerce")
+    lines = []
+    for genius_id, title, artist, year_value, view_count, lyrics in zip(
+        chunk["id"], chunk["title"], chunk["artist"], chunk["year"], views, chunk["lyrics"]
+    ):
+        view_count = _none_if_nan(view_count)
+        doc = clean_song_doc({
+            # Stable across dumps, unlike a content hash; rows without one still fall back to it
+            **({"id": genius_id} if genius_id else {}),
+            "title": _none_if_nan(title),
+            "artist": _none_if_nan(artist),
+            "year": _none_if_nan(year_value),
+            "views": int(view_count) if view_count is not None else None,
+            "lyrics": _none_if_nan(lyrics),
+        })
+        lines.append(json.dumps(doc, ensure_ascii=False))
+
+    payload = ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+    return payload, rows_in, len(lines)
+
+
+def read_chunks(input_path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    return pd.read_csv(
+        input_path,
+        usecols=READ_COLUMNS,
+        dtype=str,               # no per-chunk type inference; numbers are coerced explicitly
+        chunksize=chunk_size,
+        keep_default_na=False,   # only empty fields are missing; a title like "NA" or "null" stays text
+        na_values=[""],
+    )
+
+
+class ShardWriter:
+    """Appends NDJSON payloads to numbered shards, renaming each into place when it is full."""
+
+    def __init__(self, out_dir: str, shard_size: int):
+        self.out_dir = out_dir
+        self.shard_size = shard_size
+        self.shard = 0
+        self.docs_in_shard = 0
+        self.written = []
+        self._file = None
+        os.makedirs(out_dir, exist_ok=True)
+
+        # Leftovers of an earlier (possibly larger) run would match the loader's glob too
+        stale = glob.glob(os.path.join(out_dir, SHARD_GLOB)) + glob.glob(os.path.join(out_dir, SHARD_GLOB + ".tmp"))
+        for path in stale:
+            os.remove(path)
+        if stale:
+            print(f"Removed {len(stale)} shard(s) of a previous run from '{out_dir}'.")
+
+    def _path(self) -> str:
+        return os.path.join(self.out_dir, SHARD_NAME.format(self.shard))
+
+    def _close_shard(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        os.replace(self._path() + ".tmp", self._path())
+        self.written.append(self._path())
+        self._file = None
+        self.shard += 1
+        self.docs_in_shard = 0
+
+    def write(self, payload: bytes, docs: int) -> None:
+        if not docs:
+            return
+        # Chunks are never split, so shards can exceed shard_size by up to one chunk
+        if self.shard_size and self.docs_in_shard >= self.shard_size:
+            self._close_shard()
+        if self._file is None:
+            self._file = open(self._path() + ".tmp", "wb")
+        self._file.write(payload)
+        self.docs_in_shard += docs
+
+    def close(self) -> None:
+        self._close_shard()
+
+    def abort(self) -> None:
+        """Drop the shard being written; only complete shards keep their final name."""
+        if self._file is None:
+            return
+        self._file.close()
+        os.remove(self._path() + ".tmp")
+        self._file = None
+
+
+def run(
+    input_path: str,
+    out_dir: str,
+    workers: Optional[int] = None,
+    chunk_size: int = CHUNK_SIZE,
+    shard_size: int = SHARD_SIZE,
+) -> ShardWriter:
+    workers = workers or os.cpu_count() or 1
+    writer = ShardWriter(out_dir, shard_size)
+    pending: Deque[Future] = deque()
+    rows_in = rows_out = 0
+    started = time.monotonic()
+
+    def drain_one() -> None:
+        nonlocal rows_in, rows_out
+        payload, read, kept = pending.popleft().result()
+        writer.write(payload, kept)
+        rows_in += read
+        rows_out += kept
+        print(f"Processed {rows_in:,} rows, kept {rows_out:,} ({rows_in / (time.monotonic() - started):,.0f} rows/s)")
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for chunk in read_chunks(input_path, chunk_size):
+                pending.append(pool.submit(process_chunk, chunk))
+                # Bounded in-flight work keeps memory flat; results are written in input order
+                while len(pending) >= workers * 2:
+                    drain_one()
+            while pending:
+                drain_one()
+    except BaseException:
+        writer.abort()
+        print(f"Failed after {rows_in:,} rows; {len(writer.written)} complete shard(s) left under '{out_dir}'.")
+        raise
+    writer.close()
+
+    print(f"Done: kept {rows_out:,} of {rows_in:,} rows in {len(writer.written)} shard(s) under '{out_dir}'.")
+    return writer
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Filter the Genius CSV into NDJSON shards for load_dataset.py.")
+    parser.add_argument("input", help="Genius lyrics CSV")
+    parser.add_argument("--out", default="dataset", help="Output directory for the shards")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE, help="CSV rows per chunk")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="Documents per shard, 0 for a single file")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"Input file '{args.input}' not found.")
+        return 1
+
+    run(args.input, args.out, args.workers, args.chunksize, args.shard_size)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
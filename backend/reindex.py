@@ -0,0 +1,301 @@
+"""
+Zero-downtime blue/green reindexing behind the `songs` alias.
+
+Searches always read the `songs` alias (search_engine.INDEX_NAME). Each reload
+builds a new physical index `songs_v{n}` next to the live one:
+
+    1. create songs_v{n} with the current mapping from load_dataset.py
+    2. bulk load it at full ingest speed (no refresh, no replicas)
+    3. wait for its shards, then warm it by replaying recent queries
+    4. check the doc count and sample rankings against the live index
+    5. atomically move the alias to songs_v{n}, marking it as having served
+       (`live_since` in its mapping _meta) and the outgoing index with the
+       time it stopped serving (`retired_at`)
+    6. delete old versions, keeping the ones that served most recently for
+       rollback; builds that never went live are deleted
+
+Usage:
+    python reindex.py [songdb.ndjson ...] [--warm-url http://127.0.0.1:8000] [--keep 1]
+    python reindex.py --rollback
+"""
+import argparse
+import json
+import re
+import sys
+import urllib.request
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from elasticsearch import Elasticsearch
+
+from cache import bump_generation
+from load_dataset import BULK_THREADS, DATASET_PATH, connect, load, mapping
+from relevance_parity import SAMPLE_QUERIES, load_queries
+from search_engine import ADMIN_TOKEN, INDEX_NAME, SearchOptions, build_search_body, parse_hits, search_mode
+
+ALIAS = INDEX_NAME
+VERSION_PATTERN = re.compile(rf"^{re.escape(ALIAS)}_v(\d+)$")
+
+MIN_DOC_RATIO = 0.95  # new index must hold at least this share of the live doc count
+SAMPLE_K = 10
+KEEP_VERSIONS = 1     # old versions kept after the swap, for --rollback
+HEALTH_WAIT_SECONDS = 600  # how long to wait for the new index's shards after the load
+LIVE_MARKER = "live_since"  # mapping _meta key set on every version that has served the alias
+RETIRED_MARKER = "retired_at"  # ... and when it last stopped serving (absent while live)
+
+
+def version_of(index: str) -> Optional[int]:
+    match = VERSION_PATTERN.match(index)
+    return int(match.group(1)) if match else None
+
+
+def versions(es: Elasticsearch) -> List[str]:
+    """All physical songs_v{n} indexes, oldest first."""
+    names = es.indices.get(index=f"{ALIAS}_v*", expand_wildcards="open").keys()
+    return sorted((n for n in names if version_of(n) is not None), key=version_of)
+
+
+def served_versions(es: Elasticsearch) -> List[str]:
+    """
+    Versions that have been live behind the alias, in the order they last
+    stopped serving (most recent last), which is not version order after a
+    rollback. Versions never retired (live, or retired before the marker
+    existed) come first.
+    """
+    names = versions(es)
+    if not names:
+        return []
+    mappings = es.indices.get_mapping(index=",".join(names))
+    metas = {n: mappings[n]["mappings"].get("_meta", {}) for n in names}
+    served = [n for n in names if LIVE_MARKER in metas[n]]
+    # Same-format UTC ISO timestamps sort correctly as strings
+    return sorted(served, key=lambda n: (metas[n].get(RETIRED_MARKER, ""), version_of(n)))
+
+
+def now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def update_meta(es: Elasticsearch, index: str, **changes: Optional[str]) -> None:
+    """Set (or, with None, remove) mapping _meta keys; put_mapping replaces _meta as a whole."""
+    meta = {**es.indices.get_mapping(index=index)[index]["mappings"].get("_meta", {}), **changes}
+    es.indices.put_mapping(index=index, meta={k: v for k, v in meta.items() if v is not None})
+
+
+def mark_live(es: Elasticsearch, indexes: List[str]) -> None:
+    for index in indexes:
+        meta = es.indices.get_mapping(index=index)[index]["mappings"].get("_meta", {})
+        update_meta(es, index, **{LIVE_MARKER: meta.get(LIVE_MARKER, now()), RETIRED_MARKER: None})
+
+
+def mark_retired(es: Elasticsearch, indexes: List[str]) -> None:
+    for index in indexes:
+        meta = es.indices.get_mapping(index=index)[index]["mappings"].get("_meta", {})
+        # live_since too, for indexes that went live before markers existed
+        update_meta(es, index, **{LIVE_MARKER: meta.get(LIVE_MARKER, now()), RETIRED_MARKER: now()})
+
+
+def live_indexes(es: Elasticsearch) -> Tuple[List[str], bool]:
+    """Indexes currently behind the alias, and whether `songs` is still a plain (pre-alias) index."""
+    if es.indices.exists_alias(name=ALIAS):
+        return list(es.indices.get_alias(name=ALIAS).keys()), False
+    if es.indices.exists(index=ALIAS):
+        return [ALIAS], True
+    return [], False
+
+
+# -------------------------------
+# Warm-up and validation
+# -------------------------------
+def warm_queries(warm_url: Optional[str], queries_path: Optional[str]) -> List[Tuple[str, bool]]:
+    """Queries to replay: the API's recent queries (needs admin_token), a file, or the built-in sample set."""
+    if warm_url and not ADMIN_TOKEN:
+        print("admin_token is not set, so the API's recent queries can't be fetched; falling back to samples.")
+    elif warm_url:
+        try:
+            request = urllib.request.Request(
+                f"{warm_url.rstrip('/')}/queries/recent", headers={"X-Admin-Token": ADMIN_TOKEN}
+            )
+            with urllib.request.urlopen(request, timeout=10) as res:
+                recent = json.load(res)["queries"]
+            queries = list(dict.fromkeys((q["q"], q["is_artist_search"]) for q in recent))
+            if queries:
+                return queries
+            print("No recent queries from the API, falling back to samples.")
+        except Exception as e:
+            print(f"Could not fetch recent queries ({e}), falling back to samples.")
+    if queries_path:
+        return load_queries(queries_path)
+    return SAMPLE_QUERIES
+
+
+def scoring_for(es: Elasticsearch, index: str) -> Optional[str]:
+    """"script" if an index behind `index` has no `popularity` field (a pre-alias `songs`), like the API falls back."""
+    result = es.indices.get_field_mapping(index=index, fields="popularity")
+    mappings = getattr(result, "body", result)
+    return "script" if any(not field.get("mappings") for field in mappings.values()) else None
+
+
+def top_hits(
+    es: Elasticsearch, index: str, query: str, is_artist_search: bool, scoring: Optional[str] = None
+) -> List[str]:
+    mode = search_mode(query, is_artist_search)
+    body = build_search_body(query, is_artist_search, mode, SearchOptions(size=SAMPLE_K), scoring=scoring)
+    return [hit["id"] for hit in parse_hits(es.search(index=index, body=body))]
+
+
+def warm(es: Elasticsearch, index: str, queries: List[Tuple[str, bool]]) -> None:
+    """Replay queries so caches, global ordinals and file pages are hot before the swap."""
+    for query, is_artist_search in queries:
+        try:
+            top_hits(es, index, query, is_artist_search)
+        except Exception as e:
+            print(f"Warm-up query {query!r} failed: {e}")
+    print(f"Warmed '{index}' with {len(queries)} queries.")
+
+
+def validate(es: Elasticsearch, new_index: str, live: List[str], min_overlap: float) -> List[str]:
+    """Problems that should block the swap (empty list if the new index looks healthy)."""
+    problems = []
+    new_count = es.count(index=new_index)["count"]
+    if new_count == 0:
+        return [f"'{new_index}' is empty"]
+
+    if not live:
+        return problems
+
+    live_count = es.count(index=live)["count"]
+    print(f"Doc count: live {live_count}, new {new_count}")
+    if new_count < MIN_DOC_RATIO * live_count:
+        problems.append(f"doc count dropped from {live_count} to {new_count}")
+
+    live_scoring = scoring_for(es, ",".join(live))
+    for query, is_artist_search in SAMPLE_QUERIES:
+        before = top_hits(es, ",".join(live), query, is_artist_search, live_scoring)
+        after = top_hits(es, new_index, query, is_artist_search)
+        if before and not after:
+            problems.append(f"no results for {query!r} (live index has {len(before)})")
+            continue
+        overlap = len(set(before) & set(after)) / len(before) if before else 1.0
+        print(f"  {query[:40]:40} overlap@{SAMPLE_K} {overlap:.2f}")
+        if overlap < min_overlap:
+            problems.append(f"ranking for {query!r} changed too much (overlap {overlap:.2f})")
+    return problems
+
+
+# -------------------------------
+# Swap and cleanup
+# -------------------------------
+def swap_alias(es: Elasticsearch, new_index: str, live: List[str], legacy: bool) -> None:
+    """Point the alias at new_index in one atomic update_aliases call."""
+    if not legacy:
+        mark_retired(es, [index for index in live if version_of(index) is not None])
+    if legacy:
+        # `songs` was a plain index; it has to go in the same call for the alias to take its name
+        actions = [{"remove_index": {"index": ALIAS}}]
+    else:
+        actions = [{"remove": {"index": index, "alias": ALIAS}} for index in live]
+    actions.append({"add": {"index": new_index, "alias": ALIAS}})
+    es.indices.update_aliases(actions=actions)
+    mark_live(es, [new_index])
+    print(f"Alias '{ALIAS}' now points to '{new_index}'.")
+
+
+def collect_garbage(es: Elasticsearch, live_index: str, keep: int) -> None:
+    """
+    Delete versions older than the live index, keeping the `keep` that served
+    most recently (not the highest-numbered: after a rollback that is the bad
+    build). Builds that never went live (failed validation) are deleted.
+    """
+    served = served_versions(es)
+    older = [v for v in versions(es) if version_of(v) < version_of(live_index)]
+    kept = [v for v in served if v in older][-keep:] if keep > 0 else []
+    for index in older:
+        if index in kept:
+            continue
+        es.indices.delete(index=index)
+        print(f"Deleted {'old' if index in served else 'abandoned'} index '{index}'.")
+
+
+def rollback(es: Elasticsearch) -> int:
+    live, legacy = live_indexes(es)
+    if legacy or not live:
+        print("Nothing to roll back to.")
+        return 1
+    # The version that stopped serving most recently, whatever its number
+    previous = [v for v in served_versions(es) if v not in live]
+    if not previous:
+        print("No previous version that has been live is kept.")
+        return 1
+    swap_alias(es, previous[-1], live, legacy=False)
+    bump_generation()
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build a new songs index and swap the alias to it.")
+    parser.add_argument("paths", nargs="*", default=[DATASET_PATH], help="NDJSON files to load")
+    parser.add_argument("--threads", type=int, default=BULK_THREADS)
+    parser.add_argument("--warm-url", help="API base URL to fetch recent queries from for warm-up (needs admin_token)")
+    parser.add_argument("--warm-queries", help="Query file for warm-up (same format as relevance_parity.py)")
+    parser.add_argument("--min-overlap", type=float, default=0.0, help="Block the swap below this sample overlap")
+    parser.add_argument("--keep", type=int, default=KEEP_VERSIONS, help="Old versions to keep for rollback")
+    parser.add_argument("--resume", action="store_true", help="Continue loading the newest unaliased version")
+    parser.add_argument("--force", action="store_true", help="Swap even if validation fails")
+    parser.add_argument("--rollback", action="store_true", help="Point the alias back at the previous version")
+    args = parser.parse_args(argv)
+
+    try:
+        es = connect()
+    except Exception as e:
+        print(f"Connection failed: {e}")
+        return 1
+
+    if args.rollback:
+        return rollback(es)
+
+    live, legacy = live_indexes(es)
+    existing = versions(es)
+    if args.resume and existing and existing[-1] not in live and existing[-1] not in served_versions(es):
+        new_index = existing[-1]
+        print(f"Resuming build of '{new_index}'.")
+    else:
+        next_version = (version_of(existing[-1]) + 1) if existing else 1
+        new_index = f"{ALIAS}_v{next_version}"
+        es.indices.create(index=new_index, body=mapping)
+        print(f"Index '{new_index}' created.")
+
+    print(f"Loading '{new_index}' (live: {', '.join(live) or 'none'})...")
+    success, failed = load(
+        es, args.paths, index=new_index, threads=args.threads, resume=args.resume, invalidate_cache=False
+    )
+    print(f"Upload complete {success} documents indexed, {failed} failed.")
+
+    # Replicas were re-enabled by load(); don't serve from shards that are still recovering.
+    # The client's 120s request timeout would cut the wait short, so allow the full 10m plus slack
+    es.options(request_timeout=HEALTH_WAIT_SECONDS + 60).cluster.health(
+        index=new_index,
+        wait_for_status="yellow",
+        wait_for_no_initializing_shards=True,
+        timeout=f"{HEALTH_WAIT_SECONDS}s",
+    )
+
+    warm(es, new_index, warm_queries(args.warm_url, args.warm_queries))
+
+    problems = validate(es, new_index, live, args.min_overlap)
+    if problems:
+        print("Validation failed:\n  " + "\n  ".join(problems))
+        if not args.force:
+            print(f"Alias left on the live index. '{new_index}' kept for inspection.")
+            return 1
+
+    swap_alias(es, new_index, live, legacy)
+    generation = bump_generation()
+    print(f"Search cache invalidated (index generation {generation}).")
+
+    collect_garbage(es, new_index, args.keep)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
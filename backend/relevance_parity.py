@@ -0,0 +1,99 @@
+"""
+Relevance parity check: embedded backend vs. the live Elasticsearch ranking.
+
+Runs a sample query set through both backends and compares the top-k results
+by (title, artist). Exits non-zero when the mean overlap drops below
+--min-overlap, so it can gate changes to embedded_engine.py.
+
+Usage:
+    python relevance_parity.py [--queries queries.txt] [--k 10] [--min-overlap 0.6]
+
+A queries file has one query per line; append a tab and "artist" to run it as
+an artist search.
+"""
+import argparse
+import sys
+from typing import List, Tuple
+
+from search_engine import ElasticsearchBackend, EmbeddedBackend, SearchOptions, search_mode
+
+SAMPLE_QUERIES: List[Tuple[str, bool]] = [
+    # Short titles
+    ("shape of you", False),
+    ("hello", False),
+    ("thriller", False),
+    ("bohemian rhapsody", False),
+    ("havana", False),
+    # Artists
+    ("adele", True),
+    ("ed sheeran", True),
+    ("taylor swift", True),
+    ("bodyslam", True),
+    # Lyric lines
+    ("is this the real life is this just fantasy", False),
+    ("i will always love you", False),
+    ("we found love in a hopeless place", False),
+    # Thai
+    ("คิดถึง", False),
+    ("รักเธอ", False),
+    ("ป้าง นครินทร์", True),
+]
+
+
+def load_queries(path: str) -> List[Tuple[str, bool]]:
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            query, _, flag = line.rstrip("\n").partition("\t")
+            queries.append((query, flag.strip().lower() == "artist"))
+    return queries
+
+
+def top_keys(hits, k: int) -> List[Tuple[str, str]]:
+    return [(str(h.get("title", "")).lower(), str(h.get("artist", "")).lower()) for h in hits[:k]]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare embedded and Elasticsearch rankings.")
+    parser.add_argument("--queries", help="Query file (defaults to the built-in sample set)")
+    parser.add_argument("--k", type=int, default=10, help="Compare the top-k results")
+    parser.add_argument("--min-overlap", type=float, default=0.6, help="Fail below this mean overlap@k")
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries) if args.queries else SAMPLE_QUERIES
+    reference = ElasticsearchBackend()
+    candidate = EmbeddedBackend()
+
+    options = SearchOptions(size=args.k)
+    overlaps = []
+    top1_agree = 0
+    print(f"{'query':45} {'mode':8} {'es':>4} {'emb':>4} {'overlap@k':>9}  top1")
+    for query, is_artist_search in queries:
+        mode = search_mode(query, is_artist_search)
+        expected = top_keys(reference.search(query, mode, options), args.k)
+        actual = top_keys(candidate.search(query, mode, options), args.k)
+
+        if expected:
+            overlap = len(set(expected) & set(actual)) / len(expected)
+        else:
+            overlap = 1.0 if not actual else 0.0
+        same_top = bool(expected) and bool(actual) and expected[0] == actual[0]
+
+        overlaps.append(overlap)
+        top1_agree += same_top
+        print(f"{query[:45]:45} {mode:8} {len(expected):>4} {len(actual):>4} {overlap:>9.2f}  {'yes' if same_top else 'no'}")
+
+    mean_overlap = sum(overlaps) / len(overlaps) if overlaps else 0.0
+    print(f"\nMean overlap@{args.k}: {mean_overlap:.2f}   Top-1 agreement: {top1_agree}/{len(queries)}")
+
+    if mean_overlap < args.min_overlap:
+        print(f"FAIL: mean overlap below {args.min_overlap}")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 
 class Song(BaseModel):
@@ -11,6 +11,36 @@ class Song(BaseModel):
     views: Optional[int] = 0
     score: Optional[float] = 0.0
     year: Optional[int] = None
+    # Short lyric fragment around the match (only when requested with highlight=true)
+    highlight: Optional[str] = None
 
 class SearchResponse(BaseModel):
-    results: List[Song]
\ No newline at end of file
+    results: List[Song]
+    # Pass back as `cursor` to fetch the next page; None on the last page
+    next_cursor: Optional[str] = None
+
+class Suggestion(BaseModel):
+    text: str
+    type: str  # "title" or "artist"
+    artist: Optional[str] = None
+    views: int = 0
+
+class SuggestResponse(BaseModel):
+    suggestions: List[Suggestion]
+
+class BatchSearchItem(BaseModel):
+    q: str = Field(..., min_length=1)
+    is_artist_search: bool = False
+
+class BatchSearchRequest(BaseModel):
+    queries: List[BatchSearchItem] = Field(..., min_length=1)
+    size: int = Field(20, ge=1, le=100)
+    fields: Optional[str] = None  # comma-separated, same as /search
+    exclude: Optional[str] = None
+
+class BatchSearchResult(BaseModel):
+    results: List[Song]
+    error: Optional[str] = None
+
+class BatchSearchResponse(BaseModel):
+    responses: List[BatchSearchResult]
\ No newline at end of file
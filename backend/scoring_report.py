@@ -0,0 +1,83 @@
+"""
+Side-by-side report: precomputed `popularity` field vs. the per-hit Painless script.
+
+Runs every query of a fixed set with both scoring variants against the live
+index and reports, per query:
+- median ES `took` and client round trip for each variant,
+- whether the top-k ranking is identical, and the largest relative score gap.
+
+Requires an index loaded with the current load_dataset.py (documents carry
+`popularity`).
+
+Usage:
+    python scoring_report.py [--queries queries.txt] [--runs 20] [--k 20]
+"""
+import argparse
+import statistics
+import time
+from typing import Any, Dict, List, Tuple
+
+from relevance_parity import SAMPLE_QUERIES, load_queries
+from search_engine import INDEX_NAME, SearchOptions, build_search_body, es, parse_hits, search_mode
+
+VARIANTS = ("script", "field")
+
+
+def run(body: Dict[str, Any], runs: int) -> Tuple[List[Dict[str, Any]], float, float]:
+    """Top hits, median ES-reported took (ms) and median round trip (ms) over `runs` calls."""
+    took, round_trip = [], []
+    hits: List[Dict[str, Any]] = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        # request_cache off, otherwise repeated runs measure the shard cache
+        result = es.search(index=INDEX_NAME, body=body, request_cache=False)
+        round_trip.append((time.perf_counter() - start) * 1000)
+        took.append(result["took"])
+        hits = parse_hits(result)
+    return hits, statistics.median(took), statistics.median(round_trip)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare popularity field scoring with script scoring.")
+    parser.add_argument("--queries", help="Query file (defaults to the relevance_parity sample set)")
+    parser.add_argument("--runs", type=int, default=20, help="Timed runs per query and variant")
+    parser.add_argument("--k", type=int, default=20, help="Compare the top-k results")
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries) if args.queries else SAMPLE_QUERIES
+    options = SearchOptions(size=args.k)
+
+    print(f"{'query':40} {'mode':8} {'script took/rt':>15} {'field took/rt':>15} {'same rank':>9} {'max Δscore':>10}")
+    totals = {variant: [] for variant in VARIANTS}
+    identical = 0
+    for query, is_artist_search in queries:
+        mode = search_mode(query, is_artist_search)
+        results = {}
+        for variant in VARIANTS:
+            body = build_search_body(query, mode=mode, options=options, scoring=variant)
+            # Warm up caches and JIT before timing
+            es.search(index=INDEX_NAME, body=body, request_cache=False)
+            results[variant] = run(body, args.runs)
+            totals[variant].append(results[variant][1])
+
+        script_hits, field_hits = results["script"][0], results["field"][0]
+        same_rank = [h["id"] for h in script_hits] == [h["id"] for h in field_hits]
+        identical += same_rank
+
+        scores = {h["id"]: h["score"] for h in script_hits}
+        max_delta = max(
+            (abs(h["score"] - scores[h["id"]]) / scores[h["id"]] for h in field_hits if scores.get(h["id"])),
+            default=0.0,
+        )
+
+        timings = [f"{results[v][1]:.0f}/{results[v][2]:.1f}ms" for v in VARIANTS]
+        print(f"{query[:40]:40} {mode:8} {timings[0]:>15} {timings[1]:>15} {'yes' if same_rank else 'NO':>9} {max_delta:>10.2%}")
+
+    print()
+    for variant in VARIANTS:
+        print(f"{variant:6} mean ES took: {statistics.mean(totals[variant]):.1f} ms")
+    print(f"Identical top-{args.k} ranking: {identical}/{len(queries)} queries")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,181 @@
-from elasticsearch import Elasticsearch
-from typing import List, Dict, Any
+from elasticsearch import Elasticsearch, AsyncElasticsearch, NotFoundError
+from typing import List, Dict, Any, Optional, Tuple, Union
+from collections import deque
+from dataclasses import dataclass
 from dotenv import load_dotenv
+import asyncio
+import base64
+import json
+import logging
 import os
+import time
 import urllib3
 
 # Use absolute import
 from utils import is_lyric_query
+from embedded_engine import HIGHLIGHT_FRAGMENT_SIZE, EmbeddedSearchEngine, build_index
+from cache import CACHE_ENABLED, make_key, search_cache
+import metrics
 
 # Suppress warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 load_dotenv()
 
+logger = logging.getLogger("search")
+
 # --- CONFIGURATION ---
 ES_HOST = "https://localhost:9200"
 ES_USER = os.getenv("es_user")
 ES_PASSWORD = os.getenv("es_password")
 INDEX_NAME = "songs" 
 
-# Connect
+# Search backend: "elasticsearch" (live cluster) or "embedded" (in-process, see embedded_engine.py)
+SEARCH_BACKEND = os.getenv("search_backend", "elasticsearch").lower()
+EMBEDDED_INDEX_PATH = os.getenv("embedded_index_path", "embedded_index")
+DATASET_PATH = "songdb.ndjson"
+
+# Popularity multiplier: "field" reads the `popularity` value precomputed at ingest,
+# "script" is the old per-hit Painless script (for indexes loaded before the field existed)
+ES_POPULARITY_SCORING = os.getenv("es_popularity_scoring", "field").lower()
+
+# Pagination: default / maximum hits per page
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Fields every list result keeps, whatever projection the client asks for
+REQUIRED_FIELDS = ("title", "artist")
+
+# Most queries accepted by one /search/batch call
+MAX_BATCH_SIZE = 100
+
+# Recent first-page queries kept in memory, replayed by reindex.py to warm a new index.
+# They are other users' searches: /queries/recent only answers requests carrying this token
+RECENT_QUERIES_SIZE = 1000
+ADMIN_TOKEN = os.getenv("admin_token")
+
+# Async client pool: max open connections per ES node, and per-request timeout (seconds)
+ES_MAX_CONNECTIONS = int(os.getenv("es_max_connections", "100"))
+ES_REQUEST_TIMEOUT = float(os.getenv("es_request_timeout", "5"))
+
+# Connect (blocking client, kept for scripts and the sync search_songs API)
 es = Elasticsearch(
     ES_HOST,
     basic_auth=(ES_USER, ES_PASSWORD),
     verify_certs=False
 )
 
-def search_songs(query: str, is_artist_search: bool = False) -> List[Dict[str, Any]]:
-    """
-    Main search logic with HYBRID SCORING (Multiplier):
-    
-    Formula: Final Score = Text_Match_Score * (1 + log10(views + 1))
-    
-    Why this works:
-    - Irrelevant songs (Text Score ~1) * High Views (Multiplier 10) = 10 (Low Rank)
-    - Relevant Covers (Text Score ~20) * Low Views (Multiplier 2) = 40 (Mid Rank)
-    - Relevant Originals (Text Score ~20) * High Views (Multiplier 10) = 200 (Top Rank)
-    """
-    
-    # Determine Settings based on Query Type
+# Shared non-blocking client used by the API.
+# Created and closed by the FastAPI lifespan (see main.py), never at import time,
+# because aiohttp sessions must be bound to the running event loop.
+async_es: Optional[AsyncElasticsearch] = None
+
+# (query, is_artist_search) of recent /search calls, newest last
+recent_queries: "deque[Tuple[str, bool]]" = deque(maxlen=RECENT_QUERIES_SIZE)
+
+
+def open_async_client() -> AsyncElasticsearch:
+    """Create the shared AsyncElasticsearch client (idempotent)."""
+    global async_es
+    if async_es is None:
+        async_es = AsyncElasticsearch(
+            ES_HOST,
+            basic_auth=(ES_USER, ES_PASSWORD),
+            verify_certs=False,
+            ssl_show_warn=False,
+            connections_per_node=ES_MAX_CONNECTIONS,
+            request_timeout=ES_REQUEST_TIMEOUT,
+        )
+    return async_es
+
+
+async def close_async_client() -> None:
+    """Close the shared AsyncElasticsearch client and release its connection pool."""
+    global async_es
+    if async_es is not None:
+        await async_es.close()
+        async_es = None
+
+
+@dataclass(frozen=True)
+class SearchOptions:
+    """Paging and projection for one search: page size, cursor, _source filtering, highlight."""
+
+    size: int = DEFAULT_PAGE_SIZE
+    search_after: Optional[Tuple[float, str]] = None
+    includes: Optional[Tuple[str, ...]] = None
+    excludes: Optional[Tuple[str, ...]] = None
+    highlight: bool = False
+
+    def cache_key(self) -> str:
+        return json.dumps([self.size, self.search_after, self.includes, self.excludes, self.highlight])
+
+
+def encode_cursor(hit: Dict[str, Any]) -> str:
+    """Opaque cursor pointing just after this hit in (score desc, id asc) order."""
+    raw = json.dumps([hit["score"], hit["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    """Inverse of encode_cursor. Raises ValueError on a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        score, doc_id = json.loads(raw)
+        return float(score), str(doc_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def _split_fields(value: Optional[str]) -> Optional[Tuple[str, ...]]:
+    if not value:
+        return None
+    fields = tuple(f.strip() for f in value.split(",") if f.strip())
+    return fields or None
+
+
+def make_search_options(
+    size: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    exclude: Optional[str] = None,
+    highlight: bool = False,
+) -> SearchOptions:
+    """Build SearchOptions from request parameters (comma-separated field lists, opaque cursor)."""
+    includes = _split_fields(fields)
+    if includes is not None:
+        includes = tuple(dict.fromkeys(REQUIRED_FIELDS + includes))
+
+    excludes = _split_fields(exclude)
+    if excludes is not None:
+        excludes = tuple(f for f in excludes if f not in REQUIRED_FIELDS) or None
+
+    return SearchOptions(
+        size=max(1, min(size, MAX_PAGE_SIZE)),
+        search_after=decode_cursor(cursor) if cursor else None,
+        includes=includes,
+        excludes=excludes,
+        highlight=highlight,
+    )
+
+
+def search_mode(query: str, is_artist_search: bool = False) -> str:
+    """Classify a query as "artist", "lyric" or "default" search."""
     if is_artist_search:
+        return "artist"
+    if is_lyric_query(query):
+        return "lyric"
+    return "default"
+
+
+def mode_settings(mode: str) -> Tuple[Dict[str, float], str, float]:
+    """Field boosts, minimum_should_match and min_score for a search mode."""
+    # Determine Settings based on Query Type
+    if mode == "artist":
          boosts = {"title": 1.5, "artist": 5.0, "lyrics": 1.5}
          min_match = "2<-1"
          score_cutoff = 1.0
         
-    elif is_lyric_query(query):
+    elif mode == "lyric":
         boosts = {"title": 1.5, "artist": 1.5, "lyrics": 3.0}
         min_match = "65%" 
         score_cutoff = 0.5 
@@ -53,9 +186,63 @@ def search_songs(query: str, is_artist_search: bool = False) -> List[Dict[str, A
         min_match = "2<-1" 
         score_cutoff = 1.0
 
+    return boosts, min_match, score_cutoff
+
+
+def build_search_body(
+    query: str,
+    is_artist_search: bool = False,
+    mode: Optional[str] = None,
+    options: Optional[SearchOptions] = None,
+    scoring: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Main search logic with HYBRID SCORING (Multiplier):
+    
+    Formula: Final Score = Text_Match_Score * (1 + log10(views + 1))
+    
+    Why this works:
+    - Irrelevant songs (Text Score ~1) * High Views (Multiplier 10) = 10 (Low Rank)
+    - Relevant Covers (Text Score ~20) * Low Views (Multiplier 2) = 40 (Mid Rank)
+    - Relevant Originals (Text Score ~20) * High Views (Multiplier 10) = 200 (Top Rank)
+    """
+    
+    if mode is None:
+        mode = search_mode(query, is_artist_search)
+
+    if options is None:
+        options = SearchOptions()
+
+    if scoring is None:
+        scoring = ES_POPULARITY_SCORING
+
+    boosts, min_match, score_cutoff = mode_settings(mode)
+
+    # --- CRITICAL CHANGE: Multiplier Logic ---
+    # Multiplier = 1 + log10(views + 1), always >= 1.
+    # If views = 0, multiplier = 1 (Score is unchanged).
+    # If views = 1M, multiplier ~= 7 (Score boosted 7x).
+    if scoring == "script":
+        # Legacy: computed per matching document with a Painless script
+        popularity = {
+            "script_score": {
+                "script": {
+                    "source": "Math.log10(doc['views'].value + 1) + 1"
+                }
+            }
+        }
+    else:
+        # Precomputed at ingest (load_dataset.py) and read from doc values, no scripting.
+        # No `missing`: on an index without the field this must fail, not silently score every hit x1
+        popularity = {
+            "field_value_factor": {
+                "field": "popularity"
+            }
+        }
+
     # 2. Construct Query
     body = {
-        "size": 20,
+        "size": options.size,
         "min_score": score_cutoff,
 
         "query": {
@@ -77,37 +264,391 @@ def search_songs(query: str, is_artist_search: bool = False) -> List[Dict[str, A
                     }
                 },
                 
-                # --- CRITICAL CHANGE: Multiplier Logic ---
-                # We use a script to calculate a safe multiplier.
-                # If views = 0, multiplier = 1 (Score is unchanged).
-                # If views = 1M, multiplier ~= 7 (Score boosted 7x).
-                "script_score": {
-                    "script": {
-                        "source": "Math.log10(doc['views'].value + 1) + 1"
-                    }
-                },
+                **popularity,
                 
-                # Multiply the Text Score by the Script Result
+                # Multiply the Text Score by the popularity multiplier
                 "boost_mode": "multiply", 
                 "score_mode": "max",
             }
-        }
+        },
+
+        # Stable order for search_after paging: ties on score are broken by song id
+        "sort": [
+            {"_score": "desc"},
+            {"song_id": {"order": "asc", "unmapped_type": "keyword"}}
+        ]
     }
 
+    if options.search_after is not None:
+        body["search_after"] = list(options.search_after)
+
+    # Only fetch the fields the client asked for (full lyrics are most of the payload)
+    if options.includes or options.excludes:
+        body["_source"] = {}
+        if options.includes:
+            body["_source"]["includes"] = list(options.includes)
+        if options.excludes:
+            body["_source"]["excludes"] = list(options.excludes)
+
+    if options.highlight:
+        fragment = {"fragment_size": HIGHLIGHT_FRAGMENT_SIZE, "number_of_fragments": 1}
+        body["highlight"] = {"fields": {"lyrics": fragment, "lyrics.th": fragment}}
+
+    return body
+
+
+def parse_hits(result: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Flatten an ES search response into the list of Song dicts returned by /search."""
+    hits = []
+    for hit in result["hits"]["hits"]:
+        source = hit.get("_source", {})
+        source["id"] = hit["_id"]
+        # Debugging info
+        source["score"] = hit["_score"]
+
+        highlight = hit.get("highlight", {})
+        fragments = highlight.get("lyrics") or highlight.get("lyrics.th")
+        if fragments:
+            source["highlight"] = fragments[0]
+        hits.append(source)
+
+    return hits
+
+
+async def check_popularity_mapping(client: AsyncElasticsearch) -> None:
+    """Fall back to script scoring if the index behind the alias was loaded without `popularity`."""
+    global ES_POPULARITY_SCORING
+    if ES_POPULARITY_SCORING != "field":
+        return
+    try:
+        result = await client.indices.get_field_mapping(index=INDEX_NAME, fields="popularity")
+    except Exception as e:
+        logger.warning("Could not check the '%s' mapping for popularity: %s", INDEX_NAME, e)
+        return
+
+    mappings = getattr(result, "body", result)
+    unmapped = [index for index, field in mappings.items() if not field.get("mappings")]
+    if unmapped:
+        logger.warning(
+            "No 'popularity' field in %s; using script scoring. Reload with load_dataset.py or reindex.py to fix.",
+            ", ".join(unmapped),
+        )
+        ES_POPULARITY_SCORING = "script"
+
+
+class SearchBackend:
+    """
+    Interface behind search_songs. A backend returns the same Song dicts as
+    parse_hits (the stored document plus "id" and "score") and raises on failure.
+    """
+
+    name = "base"
+
+    def search(self, query: str, mode: str, options: SearchOptions) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def get(self, song_id: str) -> Optional[Dict[str, Any]]:
+        """Full document for one song, or None if it does not exist."""
+        raise NotImplementedError
+
+    async def asearch(self, query: str, mode: str, options: SearchOptions) -> List[Dict[str, Any]]:
+        # CPU-bound backends run in a worker thread so the event loop stays free
+        return await asyncio.to_thread(self.search, query, mode, options)
+
+    async def aget(self, song_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.get, song_id)
+
+    async def amsearch(
+        self, queries: List[Tuple[str, str]], options: SearchOptions
+    ) -> List[Union[List[Dict[str, Any]], Exception]]:
+        """Run several (query, mode) searches; each slot holds its hits or the exception it raised."""
+        return await asyncio.gather(
+            *(self.asearch(query, mode, options) for query, mode in queries),
+            return_exceptions=True,
+        )
+
+    async def open(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class ElasticsearchBackend(SearchBackend):
+    """Live Elasticsearch cluster (the default)."""
+
+    name = "elasticsearch"
+
+    def search(self, query: str, mode: str, options: SearchOptions) -> List[Dict[str, Any]]:
+        trace = metrics.current_trace()
+        with trace.stage("build_body"):
+            body = build_search_body(query, mode=mode, options=options)
+        trace.body = body
+        with trace.stage("es_round_trip"):
+            result = es.search(index=INDEX_NAME, body=body)
+        trace.record("es_took", result["took"] / 1000)
+        with trace.stage("postprocess"):
+            return parse_hits(result)
+
+    def get(self, song_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            doc = es.get(index=INDEX_NAME, id=song_id)
+        except NotFoundError:
+            return None
+        return {**doc["_source"], "id": doc["_id"]}
+
+    async def asearch(self, query: str, mode: str, options: SearchOptions) -> List[Dict[str, Any]]:
+        trace = metrics.current_trace()
+        with trace.stage("build_body"):
+            body = build_search_body(query, mode=mode, options=options)
+        trace.body = body
+        client = async_es if async_es is not None else open_async_client()
+        # Round trip vs. ES `took`: the gap is network, queueing and (de)serialization
+        with trace.stage("es_round_trip"):
+            result = await client.search(index=INDEX_NAME, body=body)
+        trace.record("es_took", result["took"] / 1000)
+        with trace.stage("postprocess"):
+            return parse_hits(result)
+
+    async def aget(self, song_id: str) -> Optional[Dict[str, Any]]:
+        client = async_es if async_es is not None else open_async_client()
+        try:
+            doc = await client.get(index=INDEX_NAME, id=song_id)
+        except NotFoundError:
+            return None
+        return {**doc["_source"], "id": doc["_id"]}
+
+    async def amsearch(
+        self, queries: List[Tuple[str, str]], options: SearchOptions
+    ) -> List[Union[List[Dict[str, Any]], Exception]]:
+        # One _msearch round trip for the whole batch
+        searches: List[Dict[str, Any]] = []
+        for query, mode in queries:
+            searches.append({"index": INDEX_NAME})
+            searches.append(build_search_body(query, mode=mode, options=options))
+
+        client = async_es if async_es is not None else open_async_client()
+        result = await client.msearch(searches=searches)
+
+        outcomes: List[Union[List[Dict[str, Any]], Exception]] = []
+        for response in result["responses"]:
+            if "error" in response:
+                error = response["error"]
+                reason = (error.get("reason") or error.get("type")) if isinstance(error, dict) else error
+                outcomes.append(RuntimeError(reason))
+            else:
+                outcomes.append(parse_hits(response))
+        return outcomes
+
+    async def open(self) -> None:
+        await check_popularity_mapping(open_async_client())
+
+    async def close(self) -> None:
+        await close_async_client()
+
+
+class EmbeddedBackend(SearchBackend):
+    """In-process engine over a memory-mapped index built from songdb.ndjson."""
+
+    name = "embedded"
+
+    def __init__(self, index_path: str = EMBEDDED_INDEX_PATH, dataset_path: str = DATASET_PATH):
+        self.index_path = index_path
+        self.dataset_path = dataset_path
+        self.engine = None
+
+    def _load(self):
+        if self.engine is None:
+            if not os.path.exists(os.path.join(self.index_path, "meta.json")):
+                print(f"Embedded index not found, building it from '{self.dataset_path}'...")
+                build_index(self.dataset_path, self.index_path)
+            self.engine = EmbeddedSearchEngine(self.index_path)
+        return self.engine
+
+    def search(self, query: str, mode: str, options: SearchOptions) -> List[Dict[str, Any]]:
+        boosts, min_match, score_cutoff = mode_settings(mode)
+        with metrics.current_trace().stage("engine"):
+            return self._load().search(
+                query,
+                boosts,
+                min_match,
+                score_cutoff,
+                size=options.size,
+                search_after=options.search_after,
+                includes=options.includes,
+                excludes=options.excludes,
+                highlight=options.highlight,
+            )
+
+    def get(self, song_id: str) -> Optional[Dict[str, Any]]:
+        return self._load().get(song_id)
+
+    async def open(self) -> None:
+        await asyncio.to_thread(self._load)
+
+    async def close(self) -> None:
+        if self.engine is not None:
+            self.engine.close()
+            self.engine = None
+
+
+BACKENDS = {
+    ElasticsearchBackend.name: ElasticsearchBackend,
+    EmbeddedBackend.name: EmbeddedBackend,
+}
+
+_backend: Optional[SearchBackend] = None
+
+
+def get_backend() -> SearchBackend:
+    """The configured search backend (created on first use)."""
+    global _backend
+    if _backend is None:
+        if SEARCH_BACKEND not in BACKENDS:
+            raise ValueError(f"Unknown search_backend '{SEARCH_BACKEND}', expected one of {sorted(BACKENDS)}")
+        _backend = BACKENDS[SEARCH_BACKEND]()
+    return _backend
+
+
+async def open_backend() -> None:
+    await get_backend().open()
+
+
+async def close_backend() -> None:
+    await get_backend().close()
+
+
+def search_songs(
+    query: str,
+    is_artist_search: bool = False,
+    options: Optional[SearchOptions] = None,
+) -> List[Dict[str, Any]]:
+    """Blocking search, for scripts and other sync callers."""
+    if options is None:
+        options = SearchOptions()
+
+    trace = metrics.current_trace()
+    started = time.perf_counter()
+    mode = search_mode(query, is_artist_search)
+    trace.mode = mode
+    trace.record("classify", time.perf_counter() - started)
+
+    key = make_key(query, is_artist_search, mode, options.cache_key())
+    if CACHE_ENABLED:
+        cached = search_cache.get(key)
+        if cached is not None:
+            trace.cache_hit = True
+            trace.hits = len(cached)
+            return cached
+
     # Execute Search
     try:
-        result = es.search(index=INDEX_NAME, body=body)
-        
-        hits = []
-        for hit in result["hits"]["hits"]:
-            source = hit["_source"]
-            source["id"] = hit["_id"]
-            # Debugging info
-            source["score"] = hit["_score"]
-            hits.append(source)
-            
-        return hits
-        
+        hits = get_backend().search(query, mode, options)
+
+    except Exception as e:
+        logger.exception("Search error (mode=%s) for %r", mode, query)
+        metrics.ERRORS.inc(mode)
+        trace.error = str(e) or type(e).__name__
+        return []
+
+    # Only successful searches are cached, so an ES outage is never remembered
+    trace.hits = len(hits)
+    if CACHE_ENABLED:
+        search_cache.set(key, hits)
+    return hits
+
+
+async def async_search_songs(
+    query: str,
+    is_artist_search: bool = False,
+    options: Optional[SearchOptions] = None,
+) -> List[Dict[str, Any]]:
+    """Non-blocking search on the configured backend (same hits as search_songs)."""
+    if options is None:
+        options = SearchOptions()
+    if options.search_after is None:
+        recent_queries.append((query, is_artist_search))
+
+    trace = metrics.current_trace()
+    started = time.perf_counter()
+    mode = search_mode(query, is_artist_search)
+    trace.mode = mode
+    trace.record("classify", time.perf_counter() - started)
+
+    key = make_key(query, is_artist_search, mode, options.cache_key())
+    if CACHE_ENABLED:
+        cached = await search_cache.aget(key)
+        if cached is not None:
+            trace.cache_hit = True
+            trace.hits = len(cached)
+            return cached
+
+    try:
+        hits = await get_backend().asearch(query, mode, options)
+
+    except Exception as e:
+        logger.exception("Search error (mode=%s) for %r", mode, query)
+        metrics.ERRORS.inc(mode)
+        trace.error = str(e) or type(e).__name__
+        return []
+
+    trace.hits = len(hits)
+    if CACHE_ENABLED:
+        await search_cache.aset(key, hits)
+    return hits
+
+
+async def async_search_songs_batch(
+    queries: List[Tuple[str, bool]],
+    options: Optional[SearchOptions] = None,
+) -> List[Tuple[List[Dict[str, Any]], Optional[str]]]:
+    """
+    Search many (query, is_artist_search) pairs at once. Cache hits are answered
+    locally and all misses go to the backend together (a single _msearch on ES).
+    Returns (hits, error) per query, in input order.
+    """
+    if options is None:
+        options = SearchOptions()
+
+    outcomes: List[Tuple[List[Dict[str, Any]], Optional[str]]] = [([], None)] * len(queries)
+    misses: List[Tuple[int, str, str]] = []
+    for i, (query, is_artist_search) in enumerate(queries):
+        if options.search_after is None:
+            recent_queries.append((query, is_artist_search))
+
+        mode = search_mode(query, is_artist_search)
+        key = make_key(query, is_artist_search, mode, options.cache_key())
+        cached = await search_cache.aget(key) if CACHE_ENABLED else None
+        if cached is not None:
+            outcomes[i] = (cached, None)
+        else:
+            misses.append((i, mode, key))
+
+    if not misses:
+        return outcomes
+
+    try:
+        results = await get_backend().amsearch([(queries[i][0], mode) for i, mode, _ in misses], options)
     except Exception as e:
-        print(f"Search Error: {e}")
-        return []
\ No newline at end of file
+        logger.exception("Batch search error (%d queries)", len(misses))
+        results = [e] * len(misses)
+
+    for (i, mode, key), result in zip(misses, results):
+        if isinstance(result, Exception):
+            metrics.ERRORS.inc(mode)
+            outcomes[i] = ([], str(result) or type(result).__name__)
+            continue
+        outcomes[i] = (result, None)
+        if CACHE_ENABLED:
+            await search_cache.aset(key, result)
+    return outcomes
+
+
+def get_song(song_id: str) -> Optional[Dict[str, Any]]:
+    """Full document for one song (blocking), or None if it does not exist."""
+    return get_backend().get(song_id)
+
+
+async def async_get_song(song_id: str) -> Optional[Dict[str, Any]]:
+    """Full document for one song, or None if it does not exist."""
+    return await get_backend().aget(song_id)
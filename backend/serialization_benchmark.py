@@ -0,0 +1,113 @@
+"""
+Micro-benchmark: CPU per /search response for each serialization path.
+
+Serializes the same page of hits (taken from bench/fixture.ndjson, lyrics
+repeated to a realistic length) with:
+
+    fastapi     response_model validation + jsonable encoding + json.dumps
+                (how /search serialized before it encoded its own response)
+    pydantic    SearchResponse(...).model_dump_json, the current default path
+    fast        fast_response.search_payload (no validation, orjson or pydantic_core)
+    fast+etag   ... plus the ETag hash
+    fast+gzip   ... plus gzip (and fast+br if brotli is installed)
+
+Usage:
+    python serialization_benchmark.py [--size 20] [--lyrics-repeat 10] [--runs 2000]
+"""
+import argparse
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List
+
+from pydantic import TypeAdapter
+
+import fast_response
+from schemas import SearchResponse
+from utils import clean_song_doc
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench", "fixture.ndjson")
+
+
+def sample_hits(size: int, lyrics_repeat: int) -> List[Dict[str, Any]]:
+    """A page of hits shaped like parse_hits output (stored fields plus id and score)."""
+    with open(FIXTURE_PATH, "r", encoding="utf-8") as f:
+        docs = [clean_song_doc(json.loads(line)) for line in f if line.strip()]
+    hits = []
+    for i in range(size):
+        doc = dict(docs[i % len(docs)])
+        doc["lyrics"] = "\n".join([doc["lyrics"]] * lyrics_repeat)
+        doc["song_id"] = doc["id"]
+        doc["popularity"] = 1.0
+        doc["score"] = 100.0 - i
+        hits.append(doc)
+    return hits
+
+
+def time_per_call(fn: Callable[[], bytes], runs: int) -> float:
+    """Best-of-5 mean microseconds per call."""
+    fn()
+    best = float("inf")
+    for _ in range(5):
+        start = time.process_time()
+        for _ in range(runs):
+            fn()
+        best = min(best, (time.process_time() - start) / runs)
+    return best * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare /search serialization paths.")
+    parser.add_argument("--size", type=int, default=20, help="Hits per page")
+    parser.add_argument("--lyrics-repeat", type=int, default=10, help="Repeat fixture lyrics to this many copies")
+    parser.add_argument("--runs", type=int, default=2000, help="Calls per timing round")
+    args = parser.parse_args()
+
+    hits = sample_hits(args.size, args.lyrics_repeat)
+    cursor = "WzkwLjAsICJiZW5jaC0wMjAiXQ=="
+    adapter = TypeAdapter(SearchResponse)
+
+    def fastapi_default() -> bytes:
+        model = SearchResponse(results=hits, next_cursor=cursor)
+        value = adapter.validate_python(model, from_attributes=True)
+        content = adapter.dump_python(value, mode="json", exclude_unset=True)
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+    def pydantic_dump() -> bytes:
+        return SearchResponse(results=hits, next_cursor=cursor).model_dump_json(exclude_unset=True).encode("utf-8")
+
+    def fast() -> bytes:
+        return fast_response.search_payload(hits, cursor)
+
+    def fast_etag() -> bytes:
+        payload = fast_response.search_payload(hits, cursor)
+        fast_response.etag_for(payload)
+        return payload
+
+    def fast_compressed(coding: str) -> Callable[[], bytes]:
+        def run() -> bytes:
+            payload = fast_response.search_payload(hits, cursor)
+            fast_response.etag_for(payload)
+            return fast_response.compress(payload, coding)
+        return run
+
+    variants = {"fastapi": fastapi_default, "pydantic": pydantic_dump, "fast": fast, "fast+etag": fast_etag,
+                "fast+gzip": fast_compressed("gzip")}
+    if fast_response.brotli is not None:
+        variants["fast+br"] = fast_compressed("br")
+
+    # Same document either way
+    assert json.loads(fast()) == json.loads(pydantic_dump()) == json.loads(fastapi_default())
+
+    encoder = "orjson" if fast_response.orjson is not None else "pydantic_core (orjson not installed)"
+    print(f"{args.size} hits, {len(pydantic_dump()):,} byte body, fast path encoder: {encoder}\n")
+    print(f"{'path':10} {'µs/response':>12} {'vs fastapi':>11} {'bytes':>8}")
+    baseline = None
+    for name, fn in variants.items():
+        micros = time_per_call(fn, args.runs)
+        baseline = baseline or micros
+        print(f"{name:10} {micros:>12.1f} {micros / baseline:>10.0%} {len(fn()):>8,}")
+
+
+if __name__ == "__main__":
+    main()
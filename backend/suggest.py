@@ -0,0 +1,145 @@
+"""
+Typeahead suggestions for titles and artists.
+
+A popularity-weighted prefix index built in-process from the dataset, so
+/suggest never touches Elasticsearch:
+
+- every distinct title (per artist) and artist becomes one entry, weighted by
+  views (an artist's weight is the sum of its songs' views);
+- entries are kept sorted by normalized text, so any prefix maps to one
+  contiguous range found with bisect;
+- the best entries for every prefix that matches more than SCAN_LIMIT entries
+  are precomputed, so a lookup either reads a table or scans a short range and
+  its cost does not grow with the number of matches.
+"""
+import heapq
+import json
+import os
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from utils import clean_song_doc
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+SUGGEST_DATASET_PATH = os.getenv("suggest_dataset_path", "songdb.ndjson")
+MAX_SUGGESTIONS = 20
+SCAN_LIMIT = 256  # prefixes matching more entries than this are answered from a table
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+
+class _PrefixTop:
+    """Best MAX_SUGGESTIONS positions of a sorted key list for any prefix."""
+
+    def __init__(self, keys: List[str], weights: List[int]):
+        self.keys = keys
+        self.weights = weights
+        self.top: Dict[str, List[int]] = {}
+
+        # Refine ranges top-down, one character at a time; only ranges above
+        # SCAN_LIMIT are tabled (and split further), so the table stays small
+        stack = [("", 0, len(keys))]
+        while stack:
+            prefix, lo, hi = stack.pop()
+            if hi - lo <= SCAN_LIMIT:
+                continue
+            self.top[prefix] = self._scan(lo, hi, MAX_SUGGESTIONS)
+
+            depth = len(prefix)
+            pos = lo
+            while pos < hi and len(keys[pos]) == depth:  # keys equal to the prefix sort first
+                pos += 1
+            while pos < hi:
+                child = keys[pos][:depth + 1]
+                end = bisect_left(keys, child + "\U0010ffff", pos, hi)
+                stack.append((child, pos, end))
+                pos = end
+
+    def _scan(self, lo: int, hi: int, limit: int) -> List[int]:
+        weights = self.weights
+        return heapq.nlargest(limit, range(lo, hi), key=lambda i: (weights[i], -i))
+
+    def lookup(self, prefix: str, limit: int) -> List[int]:
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + "\U0010ffff", lo)
+        if hi - lo > SCAN_LIMIT:
+            return self.top[prefix][:limit]
+        return self._scan(lo, hi, limit)
+
+
+class SuggestIndex:
+    def __init__(self, entries: List[Dict[str, Any]]):
+        entries = sorted(entries, key=lambda e: normalize(e["text"]))
+        self._entries = entries
+        keys = [normalize(e["text"]) for e in entries]
+        self._all = _PrefixTop(keys, [e["views"] for e in entries])
+
+        # Artist-only lookups get their own sorted list instead of filtering the shared one
+        self._artist_positions = [i for i, e in enumerate(entries) if e["type"] == "artist"]
+        self._artists = _PrefixTop(
+            [keys[i] for i in self._artist_positions],
+            [entries[i]["views"] for i in self._artist_positions],
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @classmethod
+    def from_dataset(cls, dataset_path: str = SUGGEST_DATASET_PATH) -> "SuggestIndex":
+        titles: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        artists: Dict[str, Dict[str, Any]] = {}
+
+        with open(dataset_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                doc = clean_song_doc(json.loads(line.strip()))
+                title, artist = doc.get("title"), doc.get("artist")
+                views = doc.get("views") or 0
+
+                if isinstance(title, str) and title.strip():
+                    key = (normalize(title), normalize(artist or ""))
+                    entry = titles.get(key)
+                    if entry is None or views > entry["views"]:
+                        titles[key] = {"text": title.strip(), "type": "title", "artist": artist, "views": views}
+
+                if isinstance(artist, str) and artist.strip():
+                    entry = artists.setdefault(
+                        normalize(artist), {"text": artist.strip(), "type": "artist", "artist": None, "views": 0}
+                    )
+                    entry["views"] += views
+
+        return cls(list(titles.values()) + list(artists.values()))
+
+    def suggest(self, prefix: str, limit: int = 10, artists_only: bool = False) -> List[Dict[str, Any]]:
+        """Entries whose text starts with prefix, most viewed first."""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        limit = min(limit, MAX_SUGGESTIONS)
+
+        if artists_only:
+            positions = [self._artist_positions[i] for i in self._artists.lookup(prefix, limit)]
+        else:
+            positions = self._all.lookup(prefix, limit)
+        return [self._entries[i] for i in positions]
+
+
+# Shared index, loaded by the FastAPI lifespan
+suggest_index: Optional[SuggestIndex] = None
+
+
+def load_suggest_index(dataset_path: str = SUGGEST_DATASET_PATH) -> Optional[SuggestIndex]:
+    global suggest_index
+    if not os.path.exists(dataset_path):
+        print(f"Dataset file '{dataset_path}' not found. Suggestions are disabled.")
+        return None
+    suggest_index = SuggestIndex.from_dataset(dataset_path)
+    print(f"Suggest index ready ({len(suggest_index)} entries).")
+    return suggest_index
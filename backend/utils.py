@@ -1,3 +1,6 @@
+import hashlib
+import json
+import math
 import string
 
 # Expanded Stopwords list for better accuracy
@@ -31,4 +34,45 @@ def is_lyric_query(query: str) -> bool:
     if len(tokens) > 0 and (stopword_count / len(tokens)) > 0.50:
         return True
 
-    return False
\ No newline at end of file
+    return False
+
+def clean_song_doc(doc: dict) -> dict:
+    """
+    Normalize one raw dataset record before it is indexed:
+    coerce `year` to an int (or None) and drop redundant preprocessing columns.
+    """
+    # Data Cleaning: Convert year safely
+    if "year" in doc and doc["year"]:
+        try:
+            # Handle cases where year might be ["2020"] or "2020"
+            val = doc["year"][0] if isinstance(doc["year"], list) else doc["year"]
+            doc["year"] = int(val)
+        except (ValueError, IndexError, TypeError):
+            doc["year"] = None
+
+    # Remove junk fields
+    for redundant in ["lyrics_clean", "lyrics_clean.keyword", "features.keyword", "year.keyword"]:
+        doc.pop(redundant, None)
+
+    return doc
+
+
+def song_id(doc: dict) -> str:
+    """
+    Stable document id: the record's own "id" if it has one, otherwise a hash of
+    its cleaned content. Re-loading the same dataset therefore overwrites instead
+    of duplicating, and the id doubles as the pagination tiebreak.
+    """
+    if doc.get("id"):
+        return str(doc["id"])
+    canonical = json.dumps(doc, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()[:20]
+
+
+def popularity(views) -> float:
+    """Popularity multiplier applied to text scores: 1 + log10(views + 1)."""
+    try:
+        views = max(int(views or 0), 0)
+    except (ValueError, TypeError):
+        views = 0
+    return 1 + math.log10(views + 1)
\ No newline at end of file